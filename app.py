@@ -3,7 +3,10 @@ Gastino.ai - Flask Application Factory
 """
 import os
 import logging
+import decimal
+import orjson
 from flask import Flask
+from flask.json.provider import JSONProvider
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,12 +18,50 @@ logging.basicConfig(
 logger = logging.getLogger("gastino")
 
 
+def _orjson_default(o):
+    if isinstance(o, decimal.Decimal):
+        return str(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    jsonify() über orjson — serialisiert in C, datetime/date nativ als ISO-8601.
+    Naive Zeitstempel bleiben ohne Offset, wie die bisherigen .isoformat()-Ausgaben.
+    """
+    option = orjson.OPT_NON_STR_KEYS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_orjson_default, option=self.option)
+        return self._app.response_class(body, mimetype="application/json")
+
+
+def _default_db_pool_size():
+    """Eine Verbindung pro Thread, der die DB nutzen kann: Gunicorn-Threads + Hintergrund-Pools."""
+    from core.background import POOL_SIZES
+    return int(os.getenv("GUNICORN_THREADS", "8")) + sum(POOL_SIZES.values())
+
+
 def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
 
     app.config.update(
         SECRET_KEY=os.getenv("SECRET_KEY", "dev-secret-change-me"),
         DATABASE_URL=os.getenv("DATABASE_URL", "sqlite:///gastino.db"),
+        # Pro Prozess: Request-Threads + Hintergrund-Pools (8 + 8 + 4) — mal WEB_CONCURRENCY Worker
+        DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", str(_default_db_pool_size()))),
+        DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        REDIS_URL=os.getenv("REDIS_URL"),
         AI_PROVIDER=os.getenv("AI_PROVIDER", "anthropic"),
         AI_API_KEY=os.getenv("AI_API_KEY"),
         AI_MODEL=os.getenv("AI_MODEL"),
@@ -33,7 +74,9 @@ def create_app():
         TELEGRAM_DEBUG=os.getenv("TELEGRAM_DEBUG", "true").lower() == "true",
         APP_URL=os.getenv("APP_URL"),
         STRIPE_SECRET_KEY=os.getenv("STRIPE_SECRET_KEY"),
-        MAX_CONVERSATION_HISTORY=int(os.getenv("MAX_CONVERSATION_HISTORY", "20")),
+        MAX_CONVERSATION_HISTORY=int(os.getenv("MAX_CONVERSATION_HISTORY", "6")),
+        # Debounce-Puffer liegt im Cache — ohne gemeinsames Redis standardmäßig aus
+        MESSAGE_DEBOUNCE_SECONDS=float(os.getenv("MESSAGE_DEBOUNCE_SECONDS", "2" if os.getenv("REDIS_URL") else "0")),
         ORDER_CONFIRMATION_EMOJI="✅",
     )
 
@@ -45,6 +88,7 @@ def create_app():
         response.headers["Access-Control-Allow-Origin"] = "*"
         response.headers["Access-Control-Allow-Headers"] = "Content-Type"
         response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
+        response.headers["Access-Control-Expose-Headers"] = "X-Next-Cursor"
         return response
 
     from webhook import webhook_bp
@@ -120,7 +164,9 @@ def _auto_seed():
 
     today = date.today()
     tomorrow = today + timedelta(days=1)
-    tables = {t.name: t.id for t in RestaurantTable.query.filter_by(tenant_id=tenant.id).all()}
+    tables = dict(
+        db.session.query(RestaurantTable.name, RestaurantTable.id).filter_by(tenant_id=tenant.id).all()
+    )
 
     sample = [
         {"date": today, "time": time(19, 0), "end_time": time(20, 30), "party_size": 4,
@@ -133,8 +179,7 @@ def _auto_seed():
          "guest_name": "Teamessen Sparkasse", "table_id": tables.get("Tisch 6"),
          "status": "confirmed", "source": "phone", "language": "de"},
     ]
-    for r in sample:
-        db.session.add(ReservationExtended(tenant_id=tenant.id, **r))
+    db.session.execute(db.insert(ReservationExtended), [{"tenant_id": tenant.id, **r} for r in sample])
     db.session.commit()
 
     logger.info("Auto-seed fertig")
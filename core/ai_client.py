@@ -10,16 +10,25 @@ Konfiguration in .env:
 """
 import json
 import logging
+import threading
 import requests
 
 logger = logging.getLogger("gastino.ai")
 
+# Clients/Sessions pro Prozess wiederverwenden: Keep-Alive spart den TLS-Handshake pro LLM-Call
+_SESSION = requests.Session()
+_anthropic_clients = {}  # api_key -> Anthropic
+_anthropic_lock = threading.Lock()
+
 
 def chat_completion(system_prompt: str, user_message: str, config: dict,
-                    temperature: float = 0.1, max_tokens: int = 500) -> str:
+                    temperature: float = 0.1, max_tokens: int = 500,
+                    system_suffix: str = None) -> str:
     """
     Universeller Chat-Completion Call.
     Unterstuetzt Anthropic und OpenAI-kompatible APIs.
+    system_suffix: wechselnder Teil (Gast, Verlauf) hinter dem statischen system_prompt —
+    dann wird system_prompt bei Anthropic als Prompt-Cache-Präfix markiert.
     Returns: Raw text response from the AI model.
     """
     provider = config.get("AI_PROVIDER", "anthropic")
@@ -31,19 +40,26 @@ def chat_completion(system_prompt: str, user_message: str, config: dict,
         raise ValueError("AI_API_KEY oder ANTHROPIC_API_KEY fehlt in .env")
 
     if provider == "anthropic":
-        return _call_anthropic(system_prompt, user_message, api_key, model, temperature, max_tokens)
+        if system_suffix:
+            system = [
+                {"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": system_suffix},
+            ]
+        else:
+            system = system_prompt
+        return _call_anthropic(system, user_message, api_key, model, temperature, max_tokens)
     else:
         # OpenAI, Groq, OpenRouter, oder jede OpenAI-kompatible API
+        # (statischer Teil zuerst — OpenAI cacht gleiche Präfixe automatisch)
+        if system_suffix:
+            system_prompt = f"{system_prompt}\n\n{system_suffix}"
         base_url = config.get("AI_BASE_URL", _default_base_url(provider))
         return _call_openai_compatible(system_prompt, user_message, api_key, model, base_url, temperature, max_tokens)
 
 
 def _call_anthropic(system_prompt, user_message, api_key, model, temperature, max_tokens):
     """Anthropic Claude API Call."""
-    from anthropic import Anthropic
-    client = Anthropic(api_key=api_key)
-
-    response = client.messages.create(
+    response = _anthropic_client(api_key).messages.create(
         model=model,
         max_tokens=max_tokens,
         system=system_prompt,
@@ -53,6 +69,36 @@ def _call_anthropic(system_prompt, user_message, api_key, model, temperature, ma
     return response.content[0].text.strip()
 
 
+def _anthropic_client(api_key: str):
+    """Ein Anthropic-Client pro API-Key und Prozess (thread-safe, hält seinen Verbindungspool)."""
+    client = _anthropic_clients.get(api_key)
+    if client is None:
+        from anthropic import Anthropic
+        with _anthropic_lock:
+            client = _anthropic_clients.get(api_key)
+            if client is None:
+                client = _anthropic_clients[api_key] = Anthropic(api_key=api_key)
+    return client
+
+
+def warm_up(config: dict):
+    """
+    Baut die Verbindung zum konfigurierten Provider vorab auf (Worker-Start),
+    damit die erste Gast-Nachricht nicht den TLS-Handshake bezahlt. Fehler werden nur geloggt.
+    """
+    provider = config.get("AI_PROVIDER", "anthropic")
+    api_key = config.get("AI_API_KEY") or config.get("ANTHROPIC_API_KEY")
+    if not api_key:
+        return
+    try:
+        if provider == "anthropic":
+            _anthropic_client(api_key).with_options(timeout=5, max_retries=0).models.list(limit=1)
+        else:
+            _SESSION.head(config.get("AI_BASE_URL", _default_base_url(provider)), timeout=5)
+    except Exception as e:
+        logger.warning(f"AI Warm-up fehlgeschlagen ({provider}): {e}")
+
+
 def _call_openai_compatible(system_prompt, user_message, api_key, model, base_url, temperature, max_tokens):
     """OpenAI-kompatible API Call (OpenAI, Groq, OpenRouter, etc.)."""
     url = f"{base_url}/chat/completions"
@@ -73,7 +119,7 @@ def _call_openai_compatible(system_prompt, user_message, api_key, model, base_ur
     }
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        resp = _SESSION.post(url, json=payload, headers=headers, timeout=30)
         resp.raise_for_status()
         data = resp.json()
         return data["choices"][0]["message"]["content"].strip()
@@ -0,0 +1,77 @@
+"""
+Gastino.ai - Background Tasks
+Führt I/O-lastige Arbeit (z.B. WhatsApp-Sends) in Thread-Pools aus,
+damit der Request-Thread nicht auf fremde APIs warten muss.
+
+Getrennte Pools pro Aufgabe (Bulkheads): ein hängender Graph-API-Send
+blockiert keine anderen Hintergrund-Tasks.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+logger = logging.getLogger("gastino.background")
+
+POOL_SIZES = {
+    "default": 8,
+    "outbound": 4,   # WhatsApp-Sends
+}
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def _get_executor(pool: str) -> ThreadPoolExecutor:
+    # Lazy erstellen — Threads überleben keinen fork() (Gunicorn preload)
+    executor = _executors.get(pool)
+    if executor is None:
+        with _lock:
+            executor = _executors.get(pool)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=POOL_SIZES[pool],
+                                              thread_name_prefix=f"gastino-{pool}")
+                _executors[pool] = executor
+    return executor
+
+
+def submit(pool: str, fn, *args, **kwargs):
+    """
+    Führt fn(*args, **kwargs) im angegebenen Pool mit eigenem App-Kontext aus.
+    Nur primitive Werte übergeben — ORM-Objekte gehören zur Session des Aufrufers.
+    Returns: concurrent.futures.Future
+    """
+    app = current_app._get_current_object()
+
+    def _run():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Background-Task {getattr(fn, '__name__', fn)} fehlgeschlagen: {e}", exc_info=True)
+                raise
+
+    return _get_executor(pool).submit(_run)
+
+
+def run_in_background(fn, *args, **kwargs):
+    """Wie submit(), im Default-Pool."""
+    return submit("default", fn, *args, **kwargs)
+
+
+def run_later(delay: float, fn, *args, **kwargs):
+    """
+    Wie run_in_background(), aber erst nach delay Sekunden.
+    Gewartet wird in einem threading.Timer, nicht in einem Pool-Thread.
+    """
+    app = current_app._get_current_object()
+
+    def _start():
+        with app.app_context():
+            run_in_background(fn, *args, **kwargs)
+
+    timer = threading.Timer(delay, _start)
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -0,0 +1,215 @@
+"""
+Gastino.ai - Kurzlebiger Cache
+Exakte Key/Value-Einträge mit TTL für wiederholte, teure Abfragen
+(z.B. Verfügbarkeit "Dienstag 20 Uhr, 4 Personen" mehrmals im Chat).
+
+Ohne REDIS_URL: prozess-lokal (pro Gunicorn-Worker).
+Mit REDIS_URL: gemeinsam über alle Worker/Instanzen.
+Werte werden als JSON abgelegt — nur dicts/lists/Strings/Zahlen cachen.
+"""
+import logging
+import threading
+import time as _time
+
+import orjson
+from flask import current_app, has_app_context
+
+logger = logging.getLogger("gastino.cache")
+
+_LOCAL_MAX = 5000
+
+_local = {}  # key -> (expires_at monotonic, bytes)
+_local_lock = threading.Lock()
+_redis = None
+_redis_url = None
+
+
+def _client():
+    """Redis-Client falls REDIS_URL konfiguriert ist, sonst None (lokaler Cache)."""
+    global _redis, _redis_url
+    if not has_app_context():
+        return None
+    url = current_app.config.get("REDIS_URL")
+    if not url:
+        return None
+    if _redis is None or _redis_url != url:
+        try:
+            import redis
+        except ImportError:
+            logger.warning("REDIS_URL gesetzt, aber Paket 'redis' fehlt — nutze lokalen Cache")
+            current_app.config["REDIS_URL"] = None
+            return None
+        _redis = redis.Redis.from_url(url, socket_timeout=0.5)
+        _redis_url = url
+    return _redis
+
+
+def is_shared() -> bool:
+    """
+    True, wenn der Cache über alle Worker geteilt ist (Redis). Nur dann wirken bump()/delete()
+    überall — Einträge, die sofort nach einem Schreibzugriff stimmen müssen, nur dann cachen.
+    """
+    return _client() is not None
+
+
+def get(key: str):
+    """Gecachter Wert oder None."""
+    client = _client()
+    if client is not None:
+        try:
+            raw = client.get(key)
+        except Exception as e:
+            logger.warning(f"Redis get fehlgeschlagen ({key}): {e}")
+            return None
+        return orjson.loads(raw) if raw is not None else None
+
+    entry = _local.get(key)
+    if entry is None:
+        return None
+    expires_at, raw = entry
+    if expires_at < _time.monotonic():
+        _local.pop(key, None)
+        return None
+    return orjson.loads(raw)
+
+
+def set(key: str, value, ttl: int = 30):
+    """Speichert value für ttl Sekunden."""
+    raw = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    client = _client()
+    if client is not None:
+        try:
+            client.setex(key, ttl, raw)
+        except Exception as e:
+            logger.warning(f"Redis set fehlgeschlagen ({key}): {e}")
+        return
+
+    now = _time.monotonic()
+    with _local_lock:
+        _put_local(key, raw, now + ttl, now)
+
+
+def _put_local(key: str, raw: bytes, expires_at: float, now: float):
+    """Lokal speichern; bei vollem Cache erst Abgelaufenes, notfalls alles verwerfen. Nur unter _local_lock."""
+    if len(_local) >= _LOCAL_MAX:
+        for k in [k for k, (exp, _) in _local.items() if exp < now]:
+            del _local[k]
+        if len(_local) >= _LOCAL_MAX:
+            _local.clear()
+    _local[key] = (expires_at, raw)
+
+
+def add(key: str, value, ttl: int = 30) -> bool:
+    """
+    Speichert value nur, wenn key noch nicht existiert (Redis: SET NX). True = neu angelegt.
+    Bei Redis-Fehlern True — lieber doppelt verarbeiten als eine Nachricht verlieren.
+    """
+    raw = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    client = _client()
+    if client is not None:
+        try:
+            return bool(client.set(key, raw, nx=True, ex=ttl))
+        except Exception as e:
+            logger.warning(f"Redis add fehlgeschlagen ({key}): {e}")
+            return True
+
+    now = _time.monotonic()
+    with _local_lock:
+        entry = _local.get(key)
+        if entry is not None and entry[0] >= now:
+            return False
+        _put_local(key, raw, now + ttl, now)
+        return True
+
+
+# ─── LISTEN (Debounce-Puffer) ─────────────────────────
+
+_local_lists = {}  # key -> (expires_at monotonic, [bytes])
+
+
+def push(key: str, value, ttl: int = 30) -> bool:
+    """
+    Hängt value an die Liste unter key an; die Liste läuft ttl Sekunden nach dem letzten push ab.
+    False bei Redis-Fehlern — der Aufrufer verarbeitet dann direkt.
+    """
+    raw = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    client = _client()
+    if client is not None:
+        try:
+            client.pipeline().rpush(key, raw).expire(key, ttl).execute()
+        except Exception as e:
+            logger.warning(f"Redis push fehlgeschlagen ({key}): {e}")
+            return False
+        return True
+
+    now = _time.monotonic()
+    with _local_lock:
+        entry = _local_lists.get(key)
+        items = entry[1] if entry is not None and entry[0] >= now else []
+        items.append(raw)
+        _local_lists[key] = (now + ttl, items)
+    return True
+
+
+def pop_all(key: str) -> list:
+    """Liest und löscht die Liste unter key atomar (Redis: MULTI LRANGE + DEL). Leer: []."""
+    client = _client()
+    if client is not None:
+        try:
+            raws, _ = client.pipeline(transaction=True).lrange(key, 0, -1).delete(key).execute()
+        except Exception as e:
+            logger.warning(f"Redis pop_all fehlgeschlagen ({key}): {e}")
+            return []
+        return [orjson.loads(raw) for raw in raws]
+
+    with _local_lock:
+        entry = _local_lists.pop(key, None)
+    if entry is None or entry[0] < _time.monotonic():
+        return []
+    return [orjson.loads(raw) for raw in entry[1]]
+
+
+def delete(*keys: str):
+    client = _client()
+    if client is not None:
+        try:
+            if keys:
+                client.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Redis delete fehlgeschlagen: {e}")
+        return
+
+    with _local_lock:
+        for key in keys:
+            _local.pop(key, None)
+
+
+# ─── VERSIONEN (O(1)-Invalidierung) ───────────────────
+
+_local_versions = {}
+
+
+def version(namespace: str) -> int:
+    """Aktuelle Version eines Namespaces — in Cache-Keys einbauen, bump() macht sie ungültig."""
+    client = _client()
+    if client is not None:
+        try:
+            raw = client.get(f"ver:{namespace}")
+            return int(raw) if raw is not None else 0
+        except Exception as e:
+            logger.warning(f"Redis version fehlgeschlagen ({namespace}): {e}")
+            return 0
+    return _local_versions.get(namespace, 0)
+
+
+def bump(namespace: str):
+    """Erhöht die Version; alle Keys mit der alten Version laufen einfach per TTL aus."""
+    client = _client()
+    if client is not None:
+        try:
+            client.incr(f"ver:{namespace}")
+        except Exception as e:
+            logger.warning(f"Redis bump fehlgeschlagen ({namespace}): {e}")
+        return
+    with _local_lock:
+        _local_versions[namespace] = _local_versions.get(namespace, 0) + 1
@@ -2,12 +2,19 @@
 Gastino.ai - Intent Engine
 Analysiert eingehende Nachrichten mit AI und extrahiert Intent, Sprache, Entitaeten.
 """
+import hashlib
 import json
 import logging
+import re
+from core import cache
 from core.ai_client import chat_completion
 
 logger = logging.getLogger("gastino.intent")
 
+INTENT_CACHE_TTL = 3600  # Sekunden
+INTENT_CACHE_MIN_CONFIDENCE = 0.8  # unsichere Klassifizierungen nicht festschreiben
+_CACHE_NOISE_RE = re.compile(r"[\W_]+")
+
 SYSTEM_PROMPT = """Du bist der Intent-Classifier für Gastino.ai, einen KI-Assistenten für Gastgeber.
 Analysiere die Nachricht des Gastes und antworte NUR mit einem JSON-Objekt. Kein anderer Text.
 
@@ -51,12 +58,6 @@ INTENTS:
 BETRIEBSKONTEXT:
 {tenant_context}
 
-GAST-KONTEXT:
-{guest_context}
-
-LETZTER KONVERSATIONSVERLAUF:
-{history_context}
-
 WICHTIG:
 - DATUM: Nutze IMMER {today} als heutiges Datum. "heute Abend" = {today}. "morgen" = {tomorrow}.
 - KONTEXT BEIBEHALTEN: Wenn im Konversationsverlauf bereits ein Datum, eine Uhrzeit oder Personenanzahl erwähnt wurde und der Gast diese nicht explizit ändert, übernimm die Werte aus dem Verlauf! Beispiel: Bot fragte "Für wie viele Personen?" nach Datum 2026-03-01 -> Gast antwortet "3" -> Datum bleibt 2026-03-01. Gast antwortet dann "20 Uhr" -> Datum bleibt 2026-03-01, party_size bleibt 3.
@@ -69,6 +70,14 @@ WICHTIG:
 - Wenn der Gast auf Zeitslots antwortet (z.B. "13:30", "ja den um 20 Uhr", "den ersten"), nutze intent "reservation" mit der genannten Zeit UND dem Datum aus dem Verlauf
 - Antworte NUR mit validem JSON, kein Markdown, keine Erklaerung"""
 
+# Pro Gast/Nachricht wechselnder Teil — steht NACH dem SYSTEM_PROMPT, damit dieser als
+# Präfix (Regeln + Betriebskontext, pro Tenant und Tag identisch) vom Provider gecacht werden kann.
+CONTEXT_PROMPT = """GAST-KONTEXT:
+{guest_context}
+
+LETZTER KONVERSATIONSVERLAUF:
+{history_context}"""
+
 
 def analyze_message(tenant, guest, text, history, config=None, **kwargs):
     """Analysiert eine Gastnachricht mit AI."""
@@ -94,25 +103,39 @@ def analyze_message(tenant, guest, text, history, config=None, **kwargs):
         guest_parts.append(f"Bevorzugte Sprache: {guest.language}")
     guest_context = "\n".join(guest_parts) if guest_parts else "Neuer Gast."
 
-    # Letzte 4 Nachrichten als Kontext fuer Follow-ups
-    history_lines = []
-    for msg in history[-4:]:
-        role = "Gast" if msg["role"] == "user" else "Bot"
-        history_lines.append(f"{role}: {msg['content'][:150]}")
-    history_context = "\n".join(history_lines) if history_lines else "Keine vorherige Konversation."
+    # Aufrufer hängen die aktuelle Nachricht roh an die History an — für den Cache-Key zählt aus den
+    # vorherigen Turns nur, ob der Bot zuletzt gefragt hat; die Nachricht selbst geht normalisiert ein
+    prior = history[:-1] if history and history[-1]["role"] == "user" and history[-1]["content"] == text else history
+    open_question = _bot_asked(prior)
 
     system = SYSTEM_PROMPT.format(
         today=today.isoformat(),
         tomorrow=tomorrow.isoformat(),
         weekday=weekdays_de[today.weekday()],
         tenant_context=tenant.get_full_context(),
+    )
+    context = CONTEXT_PROMPT.format(
         guest_context=guest_context,
-        history_context=history_context,
+        history_context=_history_context(history),
     )
 
+    # Key: Modell, System-Prompt (Tenant-Kontext + Datum), offene Bot-Frage ja/nein und die normalisierte
+    # Nachricht — Gast und Verlauf bewusst nicht, sonst gäbe es praktisch nie einen Treffer.
+    # Dafür werden nur Ergebnisse ohne Entities gecacht ("Danke", "Hallo", "Habt ihr WLAN?"):
+    # alles mit Datum/Personen/Items hängt am Verlauf und darf nicht in ein anderes Gespräch wandern.
+    cache_key = "intent:" + hashlib.sha256(
+        f"{config.get('AI_PROVIDER')}|{config.get('AI_MODEL')}|{system}|{int(open_question)}|{_cache_text(text)}".encode()
+    ).hexdigest()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        _apply_guest_updates(guest, cached)
+        logger.info(f"Intent (Cache): {cached.get('intent')} (lang={cached.get('language')})")
+        return cached
+
     try:
         raw = chat_completion(
             system_prompt=system,
+            system_suffix=context,
             user_message=text,
             config=config,
             temperature=0.1,
@@ -126,20 +149,11 @@ def analyze_message(tenant, guest, text, history, config=None, **kwargs):
         raw = raw.strip()
 
         analysis = json.loads(raw)
+        _apply_guest_updates(guest, analysis)
+        if analysis.get("confidence", 0) > INTENT_CACHE_MIN_CONFIDENCE and not any((analysis.get("entities") or {}).values()):
+            cache.set(cache_key, analysis, INTENT_CACHE_TTL)
 
-        detected_lang = analysis.get("language", "de")
-        if detected_lang != guest.language:
-            guest.language = detected_lang
-            from models.database import db
-            db.session.commit()
-
-        entities = analysis.get("entities", {})
-        if entities.get("room") and not guest.room_number:
-            guest.room_number = str(entities["room"])
-            from models.database import db
-            db.session.commit()
-
-        logger.info(f"Intent: {analysis.get('intent')} (lang={detected_lang}, conf={analysis.get('confidence', 0):.2f})")
+        logger.info(f"Intent: {analysis.get('intent')} (lang={analysis.get('language', 'de')}, conf={analysis.get('confidence', 0):.2f})")
         return analysis
 
     except json.JSONDecodeError as e:
@@ -148,3 +162,42 @@ def analyze_message(tenant, guest, text, history, config=None, **kwargs):
     except Exception as e:
         logger.error(f"Intent-Engine Fehler: {e}", exc_info=True)
         return {"intent": "human_needed", "language": guest.language or "de", "entities": {}, "confidence": 0.0, "needs_human": True}
+
+
+def _history_context(history: list) -> str:
+    """Letzte 4 Nachrichten als Kontext fuer Follow-ups."""
+    history_lines = []
+    for msg in history[-4:]:
+        role = "Gast" if msg["role"] == "user" else "Bot"
+        history_lines.append(f"{role}: {msg['content'][:150]}")
+    return "\n".join(history_lines) if history_lines else "Keine vorherige Konversation."
+
+
+def _bot_asked(history: list) -> bool:
+    """True, wenn die letzte Bot-Nachricht eine Frage war — kurze Antworten werden dann anders klassifiziert."""
+    for msg in reversed(history):
+        if msg["role"] != "user":
+            return msg["content"].rstrip().endswith("?")
+    return False
+
+
+def _cache_text(text: str) -> str:
+    """
+    Nachricht für den Cache-Key normalisieren: Groß-/Kleinschreibung, Satzzeichen und Leerraum
+    ignorieren — "Danke!", "danke" und "Danke 🙏" landen auf demselben Eintrag, "19:30" und "19.30" auch.
+    """
+    return _CACHE_NOISE_RE.sub(" ", text.casefold()).strip() or text  # nur Emojis: unverändert
+
+
+def _apply_guest_updates(guest, analysis):
+    """
+    Erkannte Sprache und Zimmernummer ins Gast-Profil übernehmen.
+    Kein eigener Commit — die Änderungen gehen mit persist_turn() am Ende des Turns raus.
+    """
+    detected_lang = analysis.get("language", "de")
+    if detected_lang != guest.language:
+        guest.language = detected_lang
+
+    entities = analysis.get("entities", {})
+    if entities.get("room") and not guest.room_number:
+        guest.room_number = str(entities["room"])
@@ -3,6 +3,8 @@ Gastino.ai - Message Router
 Routet analysierte Nachrichten an den richtigen Handler.
 """
 import logging
+from types import MappingProxyType
+
 from core.response_generator import generate_response
 from core.order_processor import process_order
 from core.reservation_handler import process_reservation, process_availability, process_cancellation
@@ -15,6 +17,28 @@ RESERVATION_INTENTS = {"reservation"}
 AVAILABILITY_INTENTS = {"availability"}
 ESCALATION_INTENTS = {"complaint", "human_needed"}
 
+# Statische Antworten — einmal beim Import gebaut statt pro Aufruf
+_ESCALATION_REPLIES = MappingProxyType({
+    "de": "Ich habe Ihre Anfrage an unser Team weitergeleitet. Jemand wird sich in Kürze bei Ihnen melden.",
+    "it": "Ho inoltrato la sua richiesta al nostro team. Qualcuno la contattera a breve.",
+    "en": "I've forwarded your request to our team. Someone will get back to you shortly.",
+})
+_HOUSEKEEPING_TEMPLATES = MappingProxyType({
+    "de": "Anfrage ans Housekeeping weitergeleitet{r}. Wir kümmern uns darum!",
+    "it": "Richiesta inoltrata al team pulizie{r}. Ce ne occuperemo!",
+    "en": "Request forwarded to housekeeping{r}. We'll take care of it!",
+})
+_CHECKOUT_REPLIES = MappingProxyType({
+    "de": "Rezeption informiert. Ihre Rechnung wird vorbereitet!",
+    "it": "Reception informata. Il suo conto viene preparato!",
+    "en": "Reception notified. Your bill is being prepared!",
+})
+_CANCELLATION_REPLIES = MappingProxyType({
+    "de": "Stornierungsanfrage weitergeleitet. Wir melden uns!",
+    "it": "Richiesta di cancellazione inoltrata. La contatteremo!",
+    "en": "Cancellation request forwarded. We'll get back to you!",
+})
+
 
 def route_message(tenant, guest, conversation, analysis, history, config):
     intent = analysis.get("intent", "general_question")
@@ -26,28 +50,9 @@ def route_message(tenant, guest, conversation, analysis, history, config):
     if needs_human or intent in ESCALATION_INTENTS:
         return handle_escalation(tenant, guest, analysis, history, config)
 
-    if intent in ORDER_INTENTS:
-        return process_order(tenant, guest, conversation, analysis, config)
-
-    if intent in RESERVATION_INTENTS:
-        return process_reservation(tenant, guest, conversation, analysis, config)
-
-    if intent in AVAILABILITY_INTENTS:
-        return process_availability(tenant, guest, conversation, analysis, config)
-
-    if intent == "cancel_order":
-        return process_cancellation(tenant, guest, conversation, analysis, config)
-
-    if intent == "housekeeping":
-        return handle_housekeeping(tenant, guest, analysis, config)
-
-    if intent == "checkout":
-        return handle_checkout(tenant, guest, analysis, config)
-
-    if intent in AUTO_REPLY_INTENTS:
-        return generate_response(tenant, guest, analysis, history, config)
-
-    return generate_response(tenant, guest, analysis, history, config)
+    # Alles ohne eigenen Handler (inkl. AUTO_REPLY_INTENTS) beantwortet Claude direkt
+    handler = _ROUTES.get(intent, _auto_reply)
+    return handler(tenant, guest, conversation, analysis, history, config)
 
 
 def handle_escalation(tenant, guest, analysis, history, config):
@@ -56,35 +61,49 @@ def handle_escalation(tenant, guest, analysis, history, config):
         from models.database import Department
         dept = Department.query.filter_by(tenant_id=tenant.id, is_escalation=True, active=True).first()
         if dept and dept.whatsapp_group_id:
-            from integrations.whatsapp import send_text_message
+            from integrations.whatsapp import enqueue_text_message
             from core.formatters import format_escalation_for_staff
-            send_text_message(phone_number_id=tenant.whatsapp_phone_id, to=dept.whatsapp_group_id,
+            # Staff-Benachrichtigung parallel — die Gast-Antwort wartet nicht auf die Gruppe
+            enqueue_text_message(phone_number_id=tenant.whatsapp_phone_id, to=dept.whatsapp_group_id,
                 text=format_escalation_for_staff(guest, analysis, history), token=config.get("WHATSAPP_TOKEN", ""))
     except Exception as e:
         logger.warning(f"Staff-Benachrichtigung fehlgeschlagen: {e}")
 
-    return {"de": "Ich habe Ihre Anfrage an unser Team weitergeleitet. Jemand wird sich in Kürze bei Ihnen melden.",
-            "it": "Ho inoltrato la sua richiesta al nostro team. Qualcuno la contattera a breve.",
-            "en": "I've forwarded your request to our team. Someone will get back to you shortly."}.get(language, "Ich habe Ihre Anfrage an unser Team weitergeleitet.")
+    return _ESCALATION_REPLIES.get(language, _ESCALATION_REPLIES["de"])
 
 
 def handle_housekeeping(tenant, guest, analysis, config):
     language = analysis.get("language", "de")
     room = analysis.get("entities", {}).get("room") or guest.room_number
     r = f" (Zimmer {room})" if room else ""
-    return {"de": f"Anfrage ans Housekeeping weitergeleitet{r}. Wir kümmern uns darum!",
-            "it": f"Richiesta inoltrata al team pulizie{r}. Ce ne occuperemo!",
-            "en": f"Request forwarded to housekeeping{r}. We'll take care of it!"}.get(language, f"Housekeeping informiert{r}.")
+    return _HOUSEKEEPING_TEMPLATES.get(language, _HOUSEKEEPING_TEMPLATES["de"]).format(r=r)
 
 
 def handle_checkout(tenant, guest, analysis, config):
     language = analysis.get("language", "de")
-    return {"de": "Rezeption informiert. Ihre Rechnung wird vorbereitet!",
-            "it": "Reception informata. Il suo conto viene preparato!",
-            "en": "Reception notified. Your bill is being prepared!"}.get(language, "Rezeption informiert.")
+    return _CHECKOUT_REPLIES.get(language, _CHECKOUT_REPLIES["de"])
 
 
 def handle_cancellation(tenant, guest, language, config):
-    return {"de": "Stornierungsanfrage weitergeleitet. Wir melden uns!",
-            "it": "Richiesta di cancellazione inoltrata. La contatteremo!",
-            "en": "Cancellation request forwarded. We'll get back to you!"}.get(language, "Stornierung weitergeleitet.")
+    return _CANCELLATION_REPLIES.get(language, _CANCELLATION_REPLIES["de"])
+
+
+# ─── ROUTING-TABELLE ──────────────────────────────────
+# Einheitliche Signatur (tenant, guest, conversation, analysis, history, config);
+# einmal beim Import gebaut — pro Nachricht nur noch ein Dict-Lookup statt einer if-Kette.
+
+def _auto_reply(tenant, guest, conversation, analysis, history, config):
+    return generate_response(tenant, guest, analysis, history, config)
+
+
+_ROUTES = MappingProxyType({
+    **dict.fromkeys(ORDER_INTENTS,
+                    lambda t, g, c, a, h, cfg: process_order(t, g, c, a, cfg)),
+    **dict.fromkeys(RESERVATION_INTENTS,
+                    lambda t, g, c, a, h, cfg: process_reservation(t, g, c, a, cfg)),
+    **dict.fromkeys(AVAILABILITY_INTENTS,
+                    lambda t, g, c, a, h, cfg: process_availability(t, g, c, a, cfg)),
+    "cancel_order": lambda t, g, c, a, h, cfg: process_cancellation(t, g, c, a, cfg, h),
+    "housekeeping": lambda t, g, c, a, h, cfg: handle_housekeeping(t, g, a, cfg),
+    "checkout": lambda t, g, c, a, h, cfg: handle_checkout(t, g, a, cfg),
+})
@@ -7,7 +7,7 @@ import logging
 from datetime import datetime, timezone
 
 from models.database import db, Order, Department, Guest
-from integrations.whatsapp import send_text_message
+from integrations.whatsapp import enqueue_text_message
 from core.formatters import format_order_for_staff, format_order_confirmation_for_guest
 
 logger = logging.getLogger("gastino.orders")
@@ -176,7 +176,7 @@ def _create_and_route_order(tenant, guest, items: list, dept_name: str,
     # An WhatsApp-Gruppe senden
     if target_dept.whatsapp_group_id:
         staff_msg = format_order_for_staff(order, guest, target_dept)
-        send_text_message(
+        enqueue_text_message(
             phone_number_id=tenant.whatsapp_phone_id,
             to=target_dept.whatsapp_group_id,
             text=staff_msg,
@@ -225,7 +225,7 @@ def confirm_latest_order(tenant, group_id: str):
                 "it": "Il suo ordine è in preparazione! 👨‍🍳",
                 "en": "Your order is being prepared! 👨‍🍳",
             }
-            send_text_message(
+            enqueue_text_message(
                 phone_number_id=tenant.whatsapp_phone_id,
                 to=guest.whatsapp_id,
                 text=msgs.get(lang, msgs["de"]),
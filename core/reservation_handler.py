@@ -8,10 +8,17 @@ from datetime import datetime, date, time, timedelta
 
 from models.database import db
 from core.restaurant_engine import ReservationEngine, ReservationExtended
+from core import cache
 from core.ai_client import chat_completion
 
 logger = logging.getLogger("gastino.reservations")
 
+AVAILABILITY_CACHE_TTL = 30  # Sekunden; Schreibpfade der Engine invalidieren sofort
+
+_NUMBER_RE = re.compile(r"(\d+)")
+_DAY_NAMES_DE = ("Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag")
+_LANGUAGE_NAMES = {"de": "Deutsch", "it": "Italienisch", "en": "Englisch"}
+
 
 # ─── AI RESPONSE GENERATION ─────────────────────────────
 
@@ -41,9 +48,6 @@ Antworte dem Gast natürlich und passend zur Situation. NUR die Antwort, keine E
 def _ai_response(tenant, language, situation, entities, config):
     """Generiert eine natürliche AI-Antwort für Reservierungssituationen."""
     today = date.today()
-    weekday_names = {0: "Montag", 1: "Dienstag", 2: "Mittwoch", 3: "Donnerstag",
-                     4: "Freitag", 5: "Samstag", 6: "Sonntag"}
-
     parts = []
     if entities.get("date"):
         parts.append(f"Datum: {entities['date']}")
@@ -58,8 +62,8 @@ def _ai_response(tenant, language, situation, entities, config):
     system = RESERVATION_AI_PROMPT.format(
         tenant_name=tenant.name,
         today=today.strftime("%d.%m.%Y"),
-        weekday=weekday_names.get(today.weekday(), ""),
-        language={"de": "Deutsch", "it": "Italienisch", "en": "Englisch"}.get(language, "Deutsch"),
+        weekday=_DAY_NAMES_DE[today.weekday()],
+        language=_LANGUAGE_NAMES.get(language, "Deutsch"),
         tenant_context=tenant.get_full_context() if hasattr(tenant, 'get_full_context') else "",
         situation=situation,
         entities_summary=entities_summary,
@@ -78,6 +82,14 @@ def _ai_response(tenant, language, situation, entities, config):
         return None
 
 
+def _closed_response(tenant, language, parsed_date, entities, config):
+    resp = _ai_response(tenant, language,
+        "Am {} ({}) ist Ruhetag.".format(
+            parsed_date.strftime('%d.%m.%Y'), _DAY_NAMES_DE[parsed_date.weekday()]),
+        entities, config)
+    return resp or "Am {} haben wir leider Ruhetag.".format(parsed_date.strftime('%d.%m.%Y'))
+
+
 # ─── ENTITY ACCUMULATION ─────────────────────────────────
 
 def _accumulate_entities(conversation, analysis):
@@ -101,8 +113,7 @@ def _accumulate_entities(conversation, analysis):
             stored[key] = new_val
 
     if conversation:
-        conversation.pending_entities = stored
-        db.session.commit()
+        conversation.pending_entities = stored  # Commit mit dem Turn (persist_turn)
 
     logger.info(f"Accumulated entities: {stored}")
     return stored
@@ -111,7 +122,6 @@ def _accumulate_entities(conversation, analysis):
 def _clear_pending_entities(conversation):
     if conversation:
         conversation.pending_entities = {}
-        db.session.commit()
 
 
 # ─── PROCESS AVAILABILITY ─────────────────────────────────
@@ -147,6 +157,10 @@ def process_availability(tenant, guest, conversation, analysis, config):
     party_size = int(party_size)
     engine = ReservationEngine(tenant.id)
 
+    # Ruhetag zuerst — spart die komplette Tisch-/Slot-Prüfung
+    if engine.is_closed(parsed_date):
+        return _closed_response(tenant, language, parsed_date, entities, config)
+
     if res_time:
         try:
             parsed_time = _parse_time(res_time)
@@ -154,7 +168,8 @@ def process_availability(tenant, guest, conversation, analysis, config):
             parsed_time = None
 
         if parsed_time:
-            result = engine.check_availability(parsed_date, parsed_time, party_size)
+            result = _cached_availability(engine, parsed_date, parsed_time, party_size,
+                                          lambda: engine.check_availability(parsed_date, parsed_time, party_size))
 
             if result["available"]:
                 table = result["table"]
@@ -173,10 +188,9 @@ def process_availability(tenant, guest, conversation, analysis, config):
                 alternatives = result.get("alternatives", [])
 
                 if reason == "closed":
-                    day_names = {0:"Montag",1:"Dienstag",2:"Mittwoch",3:"Donnerstag",4:"Freitag",5:"Samstag",6:"Sonntag"}
                     resp = _ai_response(tenant, language,
                         "Am {} ({}) ist Ruhetag. Schlage freundlich einen anderen Tag vor.".format(
-                            parsed_date.strftime('%d.%m.%Y'), day_names.get(parsed_date.weekday(), '')),
+                            parsed_date.strftime('%d.%m.%Y'), _DAY_NAMES_DE[parsed_date.weekday()]),
                         entities, config)
                     return resp or "Am {} haben wir leider Ruhetag.".format(parsed_date.strftime('%d.%m.%Y'))
                 elif reason == "outside_hours":
@@ -196,16 +210,10 @@ def process_availability(tenant, guest, conversation, analysis, config):
                         entities, config)
                     return resp or "Leider ist dieser Zeitpunkt ausgebucht."
 
-    slots = engine.get_available_slots(parsed_date, party_size)
+    slots = _cached_availability(engine, parsed_date, None, party_size,
+                                 lambda: engine.get_available_slots(parsed_date, party_size))
 
     if not slots:
-        if engine._is_closed(parsed_date):
-            day_names = {0:"Montag",1:"Dienstag",2:"Mittwoch",3:"Donnerstag",4:"Freitag",5:"Samstag",6:"Sonntag"}
-            resp = _ai_response(tenant, language,
-                "Am {} ({}) ist Ruhetag.".format(
-                    parsed_date.strftime('%d.%m.%Y'), day_names.get(parsed_date.weekday(), '')),
-                entities, config)
-            return resp or "Am {} haben wir leider Ruhetag.".format(parsed_date.strftime('%d.%m.%Y'))
         resp = _ai_response(tenant, language,
             "Am {} sind für {} Personen keine Plätze mehr frei.".format(
                 parsed_date.strftime('%d.%m.%Y'), party_size),
@@ -281,6 +289,9 @@ def process_reservation(tenant, guest, conversation, analysis, config):
 
     engine = ReservationEngine(tenant.id)
 
+    if engine.is_closed(parsed_date):
+        return _closed_response(tenant, language, parsed_date, entities, config)
+
     result = engine.create_reservation(
         target_date=parsed_date,
         target_time=parsed_time,
@@ -315,12 +326,7 @@ def process_reservation(tenant, guest, conversation, analysis, config):
         error = result.get("error", "fully_booked")
 
         if error == "closed":
-            day_names = {0:"Montag",1:"Dienstag",2:"Mittwoch",3:"Donnerstag",4:"Freitag",5:"Samstag",6:"Sonntag"}
-            resp = _ai_response(tenant, language,
-                "Am {} ({}) ist Ruhetag.".format(
-                    parsed_date.strftime('%d.%m.%Y'), day_names.get(parsed_date.weekday(), '')),
-                entities, config)
-            return resp or "Am {} haben wir leider Ruhetag.".format(parsed_date.strftime('%d.%m.%Y'))
+            return _closed_response(tenant, language, parsed_date, entities, config)
 
         alt_text = ""
         if alternatives:
@@ -335,23 +341,19 @@ def process_reservation(tenant, guest, conversation, analysis, config):
 
 # ─── PROCESS CANCELLATION ─────────────────────────────────
 
-def process_cancellation(tenant, guest, conversation, analysis, config):
+def process_cancellation(tenant, guest, conversation, analysis, config, history=None):
     language = analysis.get("language", "de")
     entities = analysis.get("entities", {})
     target_date_str = entities.get("date")
 
-    # Letzte User-Nachricht für Nummernauswahl
+    # Letzte User-Nachricht für Nummernauswahl (aus der History — die aktuelle ist noch nicht gespeichert)
     last_msg = ""
-    if conversation:
-        from models.database import Message
-        last = (Message.query
-                .filter_by(conversation_id=conversation.id, direction="inbound")
-                .order_by(Message.created_at.desc())
-                .first())
-        if last:
-            last_msg = last.content or ""
-
-    number_match = re.search(r'(\d+)', last_msg)
+    for msg in reversed(history or []):
+        if msg["role"] == "user":
+            last_msg = msg["content"] or ""
+            break
+
+    number_match = _NUMBER_RE.search(last_msg)
     wants_all = any(w in last_msg.lower() for w in ["alle", "tutti", "all", "alles"])
 
     # Finde Reservierungen
@@ -459,12 +461,53 @@ def _ask_missing_fallback(language, missing):
     return "Könnten Sie mir bitte die Details geben?"
 
 
+def _cached_availability(engine, target_date, target_time, party_size, compute):
+    """
+    compute() mit AVAILABILITY_CACHE_TTL cachen — nur bei gemeinsamem Cache (REDIS_URL).
+    Prozess-lokal sähen andere Worker die Invalidierung nach einer Buchung nicht und böten belegte Slots an.
+    """
+    if not cache.is_shared():
+        return compute()
+    key = engine.availability_cache_key(target_date, target_time, party_size)
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        cache.set(key, result, AVAILABILITY_CACHE_TTL)
+    return result
+
+
 # ─── PARSING HELPERS ────────────────────────────────────
 
+# Punkt/Slash/Strich mit Tag zuerst (1.3.2026) — ISO erledigt date.fromisoformat()
+_DATE_RE = re.compile(r"^(\d{1,2})([./-])(\d{1,2})\2(\d{4})$")
+_TIME_RE = re.compile(r"^(\d{1,2})[:.](\d{2})(?::(\d{2}))?$")
+_TIME_SUFFIX_RE = re.compile(r"(\d{1,2})\s*(uhr|ore|h|pm|am|oclock)?")
+
+_DAY_MAP = {"montag":0,"dienstag":1,"mittwoch":2,"donnerstag":3,"freitag":4,"samstag":5,"sonntag":6,
+            "lunedi":0,"martedi":1,"mercoledi":2,"giovedi":3,"venerdi":4,"sabato":5,"domenica":6,
+            "monday":0,"tuesday":1,"wednesday":2,"thursday":3,"friday":4,"saturday":5,"sunday":6}
+_DAY_RE = re.compile("|".join(map(re.escape, _DAY_MAP)))
+
+
 def _parse_date(date_str):
     if not date_str:
         raise ValueError("Kein Datum")
 
+    # Schnelle Pfade: C-Parser für ISO, Regex für 1.3.2026 — strptime nur noch für Exoten
+    # Nur die Form YYYY-MM-DD — fromisoformat (3.11+) nähme sonst auch Wochendaten wie "2026-W09-1" an
+    if len(date_str) == 10 and date_str[4] == "-" and date_str[7] == "-":
+        try:
+            return date.fromisoformat(date_str)
+        except ValueError:
+            pass
+
+    m = _DATE_RE.match(date_str)
+    if m:
+        try:
+            return date(int(m.group(4)), int(m.group(3)), int(m.group(1)))
+        except ValueError:
+            pass  # z.B. 31.02. — wie bisher über die Fallbacks laufen lassen
+
     for fmt in ["%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y"]:
         try:
             return datetime.strptime(date_str, fmt).date()
@@ -480,15 +523,12 @@ def _parse_date(date_str):
     if lower in ("übermorgen", "dopodomani", "day after tomorrow"):
         return today + timedelta(days=2)
 
-    day_map = {"montag":0,"dienstag":1,"mittwoch":2,"donnerstag":3,"freitag":4,"samstag":5,"sonntag":6,
-               "lunedi":0,"martedi":1,"mercoledi":2,"giovedi":3,"venerdi":4,"sabato":5,"domenica":6,
-               "monday":0,"tuesday":1,"wednesday":2,"thursday":3,"friday":4,"saturday":5,"sunday":6}
-    for day_name, day_num in day_map.items():
-        if day_name in lower:
-            days_ahead = day_num - today.weekday()
-            if days_ahead <= 0:
-                days_ahead += 7
-            return today + timedelta(days=days_ahead)
+    m = _DAY_RE.search(lower)
+    if m:
+        days_ahead = _DAY_MAP[m.group(0)] - today.weekday()
+        if days_ahead <= 0:
+            days_ahead += 7
+        return today + timedelta(days=days_ahead)
 
     raise ValueError("Unbekanntes Datum: {}".format(date_str))
 
@@ -497,13 +537,28 @@ def _parse_time(time_str):
     if not time_str:
         raise ValueError("Keine Uhrzeit")
 
+    if time_str[2:3] == ":":  # nur HH:MM[:SS] — fromisoformat liest "19.30" sonst als Sekundenbruchteil
+        try:
+            parsed = time.fromisoformat(time_str)
+            if parsed.tzinfo is None:
+                return parsed
+        except ValueError:
+            pass
+
+    m = _TIME_RE.match(time_str)
+    if m:
+        try:
+            return time(int(m.group(1)), int(m.group(2)), int(m.group(3) or 0))
+        except ValueError:
+            pass
+
     for fmt in ["%H:%M", "%H.%M", "%H:%M:%S"]:
         try:
             return datetime.strptime(time_str, fmt).time()
         except ValueError:
             continue
 
-    match = re.search(r"(\d{1,2})\s*(uhr|ore|h|pm|am|oclock)?", time_str.lower())
+    match = _TIME_SUFFIX_RE.search(time_str.lower())
     if match:
         hour = int(match.group(1))
         suffix = match.group(2) or ""
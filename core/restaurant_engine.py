@@ -4,11 +4,18 @@ Komplettes Reservierungssystem: Tischverwaltung, Kapazitätsplanung,
 Verfügbarkeitsprüfung, automatische Bestätigungen, No-Show-Tracking.
 """
 import logging
+from bisect import bisect_left
 from datetime import datetime, date, time, timedelta, timezone
+from itertools import accumulate
+from sqlalchemy.orm import joinedload
 from models.database import db, Tenant, Guest, Reservation
+from core import cache
 
 logger = logging.getLogger("gastino.reservations")
 
+CLOSED_DAYS_CACHE_TTL = 300  # Sekunden
+DEFAULT_SLOT_MINUTES = 90  # Dauer für Reservierungen ohne end_time
+
 
 # ─── TABLE MODEL (neue Tabelle) ────────────────────────
 
@@ -30,6 +37,7 @@ class RestaurantTable(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("tenant_id", "name", name="uq_table_name"),
+        db.Index("ix_tbl_tenant_active_zone_name", "tenant_id", "active", "zone", "name"),
     )
 
 
@@ -100,6 +108,11 @@ class ReservationExtended(db.Model):
     cancelled_at = db.Column(db.DateTime)
     noshow_marked_at = db.Column(db.DateTime)
 
+    __table_args__ = (
+        db.Index("ix_res_tenant_date_time", "tenant_id", "date", "time"),
+        db.Index("ix_res_tenant_status", "tenant_id", "status"),
+    )
+
     # Relations
     table = db.relationship("RestaurantTable", backref="reservations")
     guest = db.relationship("Guest", backref="reservations_v2")
@@ -127,6 +140,12 @@ class ReservationEngine:
 
     def __init__(self, tenant_id: str):
         self.tenant_id = tenant_id
+        # Konfiguration pro Instanz gemerkt — eine Instanz lebt eine Nachricht/einen Request,
+        # ein Slot-Durchlauf liest Service-Zeiten und Tische so nur einmal statt pro Slot.
+        self._periods_by_weekday = {}
+        self._tables_by_party_size = {}
+        self._bookings_by_date = {}
+        self._closed_rules = None
 
     # ─── VERFÜGBARKEIT ──────────────────────────────
 
@@ -136,14 +155,10 @@ class ReservationEngine:
         Returns: [{"time": "19:00", "tables": ["Tisch 3", "Tisch 7"], "zone": "innen"}, ...]
         """
         # Prüfe ob Restaurant geschlossen ist
-        if self._is_closed(target_date):
+        if self.is_closed(target_date):
             return []
 
-        weekday = target_date.weekday()
-        periods = ServicePeriod.query.filter_by(
-            tenant_id=self.tenant_id, day_of_week=weekday, active=True
-        ).all()
-
+        periods = self._service_periods(target_date.weekday())
         if not periods:
             return []
 
@@ -167,7 +182,7 @@ class ReservationEngine:
         Prüft ob ein spezifischer Zeitpunkt verfügbar ist.
         Returns: {"available": True, "table": {...}, "alternatives": [...]}
         """
-        if self._is_closed(target_date):
+        if self.is_closed(target_date):
             return {"available": False, "reason": "closed", "alternatives": []}
 
         # Service-Periode finden
@@ -205,9 +220,11 @@ class ReservationEngine:
                            zone_preference: str = None,
                            notes: str = None, special_requests: str = None,
                            source: str = "whatsapp",
-                           guest_id: str = None) -> dict:
+                           guest_id: str = None,
+                           status: str = "confirmed") -> dict:
         """
         Erstellt eine neue Reservierung mit automatischer Tischzuweisung.
+        status="seated" legt sie direkt als gesetzt an (Walk-in) — in derselben Transaktion.
         Returns: {"success": True, "reservation": {...}} oder {"success": False, "error": "..."}
         """
         # Verfügbarkeit prüfen
@@ -237,6 +254,7 @@ class ReservationEngine:
         end_time = end_dt.time()
 
         # Reservierung erstellen
+        now = datetime.now(timezone.utc)
         reservation = ReservationExtended(
             tenant_id=self.tenant_id,
             guest_id=guest_id,
@@ -249,14 +267,16 @@ class ReservationEngine:
             language=language,
             table_id=table_id,
             zone_preference=zone_preference,
-            status="confirmed",
+            status=status,
             source=source,
             notes=notes,
             special_requests=special_requests,
-            confirmed_at=datetime.now(timezone.utc),
+            confirmed_at=now,
+            seated_at=now if status == "seated" else None,
         )
         db.session.add(reservation)
         db.session.commit()
+        self.invalidate_availability(target_date)
 
         logger.info(f"Reservierung erstellt: {reservation.id} — {target_date} {target_time}, "
                     f"{party_size} Pers., Tisch {availability['table']['name']}")
@@ -274,6 +294,21 @@ class ReservationEngine:
             },
         }
 
+    def create_walkin(self, party_size: int, guest_name: str = "Walk-in") -> dict:
+        """Walk-in: Reservierung ab jetzt, direkt als gesetzt — ein Commit statt zwei."""
+        now = datetime.now()
+        result = self.create_reservation(
+            target_date=now.date(),
+            target_time=now.time().replace(second=0, microsecond=0),
+            party_size=party_size,
+            guest_name=guest_name,
+            source="walkin",
+            status="seated",
+        )
+        if result["success"]:
+            result["reservation"]["status"] = "seated"
+        return result
+
     # ─── STATUS MANAGEMENT ──────────────────────────
 
     def seat_guest(self, reservation_id: str) -> bool:
@@ -283,6 +318,7 @@ class ReservationEngine:
             res.status = "seated"
             res.seated_at = datetime.now(timezone.utc)
             db.session.commit()
+            self.invalidate_availability(res.date)
             return True
         return False
 
@@ -293,6 +329,7 @@ class ReservationEngine:
             res.status = "completed"
             res.completed_at = datetime.now(timezone.utc)
             db.session.commit()
+            self.invalidate_availability(res.date)
             return True
         return False
 
@@ -303,6 +340,7 @@ class ReservationEngine:
             res.status = "noshow"
             res.noshow_marked_at = datetime.now(timezone.utc)
             db.session.commit()
+            self.invalidate_availability(res.date)
             logger.info(f"No-Show markiert: {res.guest_name} ({res.date} {res.time})")
             return True
         return False
@@ -314,6 +352,7 @@ class ReservationEngine:
             res.status = "cancelled"
             res.cancelled_at = datetime.now(timezone.utc)
             db.session.commit()
+            self.invalidate_availability(res.date)
             return True
         return False
 
@@ -323,6 +362,7 @@ class ReservationEngine:
         """Komplette Tagesübersicht für Dashboard."""
         reservations = (
             ReservationExtended.query
+            .options(joinedload(ReservationExtended.table))
             .filter_by(tenant_id=self.tenant_id, date=target_date)
             .filter(ReservationExtended.status.in_(["confirmed", "seated"]))
             .order_by(ReservationExtended.time)
@@ -355,7 +395,7 @@ class ReservationEngine:
 
         return {
             "date": target_date.isoformat(),
-            "is_closed": self._is_closed(target_date),
+            "is_closed": self.is_closed(target_date),
             "total_tables": len(tables),
             "total_seats": total_seats,
             "booked_seats": booked_seats,
@@ -485,35 +525,94 @@ class ReservationEngine:
 
         if marked:
             db.session.commit()
+            self.invalidate_availability(date.today())
             logger.info(f"Auto No-Show: {len(marked)} Reservierungen markiert")
 
         return marked
 
-    # ─── PRIVATE HELPERS ────────────────────────────
+    # ─── RUHETAGE ───────────────────────────────────
 
-    def _is_closed(self, target_date: date) -> bool:
-        """Prüft ob das Restaurant an diesem Tag geschlossen ist."""
-        # Spezifisches Datum
-        specific = ClosedDay.query.filter_by(
-            tenant_id=self.tenant_id, date=target_date
-        ).first()
-        if specific:
-            return True
+    def is_closed(self, target_date: date) -> bool:
+        """
+        Prüft ob das Restaurant an diesem Tag geschlossen ist. Die Ruhetage werden pro Instanz einmal gelesen;
+        über Requests hinweg nur im gemeinsamen Cache (5 min) — create_reservation verlässt sich darauf,
+        ein prozess-lokaler Cache würde neue Ruhetage auf anderen Workern übersehen.
+        """
+        rules = self._closed_rules
+        if rules is None:
+            key = f"closed:{self.tenant_id}"
+            shared = cache.is_shared()
+            rules = cache.get(key) if shared else None
+            if rules is None:
+                rows = (
+                    db.session.query(ClosedDay.date, ClosedDay.recurring_weekday)
+                    .filter_by(tenant_id=self.tenant_id)
+                    .all()
+                )
+                rules = {
+                    "dates": [d.toordinal() for d, _ in rows if d],
+                    "weekdays": [w for _, w in rows if w is not None],
+                }
+                if shared:
+                    cache.set(key, rules, CLOSED_DAYS_CACHE_TTL)
+            self._closed_rules = rules
+        return target_date.toordinal() in rules["dates"] or target_date.weekday() in rules["weekdays"]
+
+    def invalidate_closed_days(self):
+        self._closed_rules = None
+        cache.delete(f"closed:{self.tenant_id}")
+
+    # ─── CACHE ──────────────────────────────────────
+
+    def availability_cache_key(self, target_date: date, target_time: time, party_size: int) -> str:
+        """Key mit Tenant- und Tages-Version — invalidate_availability() erhöht sie, statt Keys zu suchen."""
+        ordinal = target_date.toordinal()
+        minutes = target_time.hour * 60 + target_time.minute if target_time else "x"
+        tenant_version = cache.version(f"avail:{self.tenant_id}")
+        day_version = cache.version(f"avail:{self.tenant_id}:{ordinal}")
+        return f"avail:{self.tenant_id}:v{tenant_version}:{ordinal}:v{day_version}:{minutes}:{party_size}"
+
+    def invalidate_availability(self, target_date: date = None):
+        """
+        Verwirft gecachte Verfügbarkeiten — für ein Datum oder (ohne Datum) alle des Tenants —
+        und macht die gecachten Dashboard-Antworten des Tenants ungültig.
+        """
+        if target_date:
+            cache.bump(f"avail:{self.tenant_id}:{target_date.toordinal()}")
+        else:
+            cache.bump(f"avail:{self.tenant_id}")
+        cache.bump(f"tenant:{self.tenant_id}")
+        self._bookings_by_date.clear()
+
+    # ─── PRIVATE HELPERS ────────────────────────────
 
-        # Wiederkehrender Wochentag
-        recurring = ClosedDay.query.filter_by(
-            tenant_id=self.tenant_id, recurring_weekday=target_date.weekday()
-        ).first()
-        return bool(recurring)
+    def _service_periods(self, weekday: int) -> list:
+        periods = self._periods_by_weekday.get(weekday)
+        if periods is None:
+            periods = ServicePeriod.query.filter_by(
+                tenant_id=self.tenant_id, day_of_week=weekday, active=True
+            ).all()
+            self._periods_by_weekday[weekday] = periods
+        return periods
+
+    def _candidate_tables(self, party_size: int) -> list:
+        """Alle aktiven Tische die zur Gruppengröße passen, nach Priorität."""
+        tables = self._tables_by_party_size.get(party_size)
+        if tables is None:
+            tables = (
+                RestaurantTable.query
+                .filter_by(tenant_id=self.tenant_id, active=True)
+                .filter(RestaurantTable.max_seats >= party_size)
+                .filter(RestaurantTable.min_seats <= party_size)
+                .order_by(RestaurantTable.priority, RestaurantTable.max_seats)
+                .all()
+            )
+            self._tables_by_party_size[party_size] = tables
+        return tables
 
     def _find_service_period(self, target_date: date, target_time: time):
         """Findet die passende Service-Periode."""
-        weekday = target_date.weekday()
-        periods = ServicePeriod.query.filter_by(
-            tenant_id=self.tenant_id, day_of_week=weekday, active=True
-        ).all()
-
-        for p in periods:
+        for p in self._service_periods(target_date.weekday()):
             if p.start_time <= target_time <= p.end_time:
                 return p
         return None
@@ -533,45 +632,57 @@ class ReservationEngine:
     def _find_available_tables(self, target_date: date, target_time: time,
                                party_size: int, slot_duration: int) -> list:
         """Findet verfügbare Tische für eine bestimmte Zeit und Gruppengröße."""
-        # Alle aktiven Tische die groß genug sind
-        tables = (
-            RestaurantTable.query
-            .filter_by(tenant_id=self.tenant_id, active=True)
-            .filter(RestaurantTable.max_seats >= party_size)
-            .filter(RestaurantTable.min_seats <= party_size)
-            .order_by(RestaurantTable.priority, RestaurantTable.max_seats)
-            .all()
-        )
+        tables = self._candidate_tables(party_size)
+        bookings = self._day_bookings(target_date)
 
-        # Zeitfenster berechnen
-        start_dt = datetime.combine(target_date, target_time)
-        end_dt = start_dt + timedelta(minutes=slot_duration)
+        # Zeitfenster in Sekunden seit Mitternacht
+        start = _seconds(target_time)
+        end = start + slot_duration * 60
 
         available = []
         for table in tables:
-            # Prüfe ob der Tisch in diesem Zeitfenster frei ist
-            conflicting = (
-                ReservationExtended.query
-                .filter_by(tenant_id=self.tenant_id, date=target_date, table_id=table.id)
-                .filter(ReservationExtended.status.in_(["confirmed", "seated"]))
-                .all()
-            )
-
-            is_free = True
-            for res in conflicting:
-                res_start = datetime.combine(target_date, res.time)
-                res_end = datetime.combine(target_date, res.end_time) if res.end_time else res_start + timedelta(minutes=slot_duration)
-
-                # Überlappung prüfen
-                if start_dt < res_end and end_dt > res_start:
-                    is_free = False
-                    break
-
-            if is_free:
-                available.append(table)
+            booked = bookings.get(table.id)
+            if booked:
+                # Belegt, wenn eine Reservierung vor `end` beginnt und nach `start` endet:
+                # alle mit Beginn < end per bisect, deren spätestes Ende über das laufende Maximum.
+                starts, max_ends = booked
+                k = bisect_left(starts, end)
+                if k and max_ends[k - 1] > start:
+                    continue
+            available.append(table)
 
         return available
 
+    def _day_bookings(self, target_date: date) -> dict:
+        """
+        Aktive Reservierungen des Tages pro Tisch: {table_id: (Startzeiten sortiert, laufendes Max. der Endzeiten)}.
+        Eine Abfrage pro Datum und Engine-Instanz statt einer pro Tisch und Slot.
+        """
+        bookings = self._bookings_by_date.get(target_date)
+        if bookings is None:
+            rows = (
+                db.session.query(ReservationExtended.table_id, ReservationExtended.time, ReservationExtended.end_time)
+                .filter(
+                    ReservationExtended.tenant_id == self.tenant_id,
+                    ReservationExtended.date == target_date,
+                    ReservationExtended.status.in_(["confirmed", "seated"]),
+                    ReservationExtended.table_id.isnot(None),
+                )
+                .order_by(ReservationExtended.time)
+                .all()
+            )
+            intervals = {}
+            for table_id, res_start, res_end in rows:
+                start = _seconds(res_start)
+                end = _seconds(res_end) if res_end else start + DEFAULT_SLOT_MINUTES * 60
+                intervals.setdefault(table_id, []).append((start, end))
+            bookings = {
+                table_id: ([start for start, _ in ivs], list(accumulate((end for _, end in ivs), max)))
+                for table_id, ivs in intervals.items()
+            }
+            self._bookings_by_date[target_date] = bookings
+        return bookings
+
     def _find_alternative_slots(self, target_date: date, party_size: int,
                                 preferred_time: time) -> list:
         """Findet alternative Zeitslots wenn der gewünschte ausgebucht ist."""
@@ -588,6 +699,10 @@ class ReservationEngine:
         return [{"time": s["time"], "period": s["period"]} for s in all_slots[:5]]
 
 
+def _seconds(t: time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
 # ─── SETUP HELPER ──────────────────────────────────────
 
 def setup_restaurant_defaults(tenant_id: str, config: dict = None):
@@ -612,56 +727,59 @@ def setup_restaurant_defaults(tenant_id: str, config: dict = None):
         {"name": "Terrasse 3", "zone": "terrasse", "min": 4, "max": 6, "priority": 4},
     ])
 
-    for t in tables:
-        table = RestaurantTable(
-            tenant_id=tenant_id,
-            name=t["name"],
-            zone=t["zone"],
-            min_seats=t["min"],
-            max_seats=t["max"],
-            priority=t.get("priority", 5),
-        )
-        db.session.add(table)
+    # Mehrzeilige INSERTs statt einem add() pro Zeile; alles in einer Transaktion.
+    # Leere Liste überspringen — execute() mit [] schriebe sonst eine Zeile nur aus Defaults.
+    if tables:
+        db.session.execute(db.insert(RestaurantTable), [{
+            "tenant_id": tenant_id,
+            "name": t["name"],
+            "zone": t["zone"],
+            "min_seats": t["min"],
+            "max_seats": t["max"],
+            "priority": t.get("priority", 5),
+        } for t in tables])
 
     # Standard Service-Perioden (Mo-Sa, Mittag + Abend)
     closed_day = config.get("closed_day", 0)  # Default: Montag Ruhetag
 
+    if closed_day in range(7):
+        db.session.execute(db.insert(ClosedDay), [{
+            "tenant_id": tenant_id,
+            "date": date.today(),  # Platzhalter
+            "recurring_weekday": closed_day,
+            "reason": "Ruhetag",
+        }])
+
+    periods = []
     for weekday in range(7):
         if weekday == closed_day:
-            closed = ClosedDay(
-                tenant_id=tenant_id,
-                date=date.today(),  # Platzhalter
-                recurring_weekday=weekday,
-                reason="Ruhetag",
-            )
-            db.session.add(closed)
             continue
-
         # Mittagessen
-        lunch = ServicePeriod(
-            tenant_id=tenant_id,
-            name="Mittagessen",
-            day_of_week=weekday,
-            start_time=time(11, 30),
-            end_time=time(14, 0),
-            last_seating=time(13, 30),
-            slot_duration_min=90,
-            slot_interval_min=30,
-        )
-        db.session.add(lunch)
-
+        periods.append({
+            "tenant_id": tenant_id,
+            "name": "Mittagessen",
+            "day_of_week": weekday,
+            "start_time": time(11, 30),
+            "end_time": time(14, 0),
+            "last_seating": time(13, 30),
+            "slot_duration_min": 90,
+            "slot_interval_min": 30,
+        })
         # Abendessen
-        dinner = ServicePeriod(
-            tenant_id=tenant_id,
-            name="Abendessen",
-            day_of_week=weekday,
-            start_time=time(18, 0),
-            end_time=time(22, 0),
-            last_seating=time(21, 0),
-            slot_duration_min=config.get("dinner_duration", 90),
-            slot_interval_min=30,
-        )
-        db.session.add(dinner)
+        periods.append({
+            "tenant_id": tenant_id,
+            "name": "Abendessen",
+            "day_of_week": weekday,
+            "start_time": time(18, 0),
+            "end_time": time(22, 0),
+            "last_seating": time(21, 0),
+            "slot_duration_min": config.get("dinner_duration", 90),
+            "slot_interval_min": 30,
+        })
+    db.session.execute(db.insert(ServicePeriod), periods)
 
     db.session.commit()
+    engine = ReservationEngine(tenant_id)
+    engine.invalidate_closed_days()
+    engine.invalidate_availability()
     logger.info(f"Restaurant-Defaults eingerichtet für Tenant {tenant_id}")
@@ -0,0 +1,48 @@
+"""
+Gastino.ai - Gunicorn-Konfiguration
+Start: gunicorn -c gunicorn.conf.py "app:create_app()"
+
+gthread: jeder Worker bedient mehrere Requests parallel, während einer auf DB oder LLM wartet.
+Modul-globaler Zustand (HTTP-Sessions, Caches, Thread-Pools) muss deshalb thread-safe sein.
+"""
+import os
+import threading
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# Wenige Prozesse, Parallelität über Threads: jeder Worker hat eigene DB-/Redis-/HTTP-Pools und eigenen
+# Speicher — cpu*2+1 würde das auf großen Hosts vervielfachen. Mehr nur bewusst per WEB_CONCURRENCY.
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = 60
+
+# App einmal im Master laden (Imports, Mapper-Konfiguration), Worker erben sie per Copy-on-Write
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Der Master hat beim Laden schon DB-Verbindungen geöffnet (create_all, Auto-Seed) —
+    # die dürfen Worker nicht mitbenutzen. close=False: nur den Pool verwerfen, Sockets des Masters nicht schließen.
+    from models.database import db
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    # DB-Pool, LLM-API und Graph API vorwärmen — im Hintergrund, damit der Worker sofort Requests annimmt.
+    # Die erste Nachricht nach einem Deploy/Scale-out spart so die Verbindungsaufbauten.
+    def warm_up():
+        from core import ai_client
+        from integrations import whatsapp
+        from models.database import db
+        app = worker.app.wsgi()
+        with app.app_context():
+            try:
+                db.engine.connect().close()
+            except Exception as e:
+                worker.log.warning(f"DB Warm-up fehlgeschlagen: {e}")
+            ai_client.warm_up(app.config)
+            whatsapp.warm_up()
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
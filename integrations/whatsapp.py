@@ -4,11 +4,27 @@ Wrapper für die Meta WhatsApp Business Cloud API.
 """
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger("gastino.whatsapp")
 
 BASE_URL = "https://graph.facebook.com/v21.0"
 
+# Eine Session pro Prozess: Keep-Alive zu graph.facebook.com spart den TCP/TLS-Handshake pro Send.
+# Retry nur für Verbindungsfehler — POSTs werden nach gesendeten Daten nicht wiederholt (keine Doppel-Nachrichten).
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50,
+                                       max_retries=Retry(total=3, backoff_factor=0.2)))
+
+
+def warm_up():
+    """Öffnet vorab eine Keep-Alive-Verbindung zur Graph API (Worker-Start). Fehler werden nur geloggt."""
+    try:
+        _SESSION.head(BASE_URL, timeout=5)
+    except Exception as e:
+        logger.warning(f"WhatsApp Warm-up fehlgeschlagen: {e}")
+
 
 def send_text_message(phone_number_id: str, to: str, text: str, token: str) -> dict:
     """
@@ -39,7 +55,7 @@ def send_text_message(phone_number_id: str, to: str, text: str, token: str) -> d
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = _SESSION.post(url, json=payload, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
         logger.info(f"Nachricht gesendet an {to[-4:]}: {text[:50]}...")
@@ -59,6 +75,16 @@ def send_text_message(phone_number_id: str, to: str, text: str, token: str) -> d
         return {"error": str(e)}
 
 
+def enqueue_text_message(phone_number_id: str, to: str, text: str, token: str):
+    """
+    Stellt send_text_message in den Outbound-Pool und kehrt sofort zurück.
+    Returns: concurrent.futures.Future mit der API-Response
+    """
+    from core.background import submit
+    return submit("outbound", send_text_message,
+                  phone_number_id=phone_number_id, to=to, text=text, token=token)
+
+
 def send_template_message(phone_number_id: str, to: str, template_name: str,
                           language_code: str, token: str,
                           components: list = None) -> dict:
@@ -87,7 +113,7 @@ def send_template_message(phone_number_id: str, to: str, template_name: str,
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = _SESSION.post(url, json=payload, headers=headers, timeout=10)
         response.raise_for_status()
         return response.json()
 
@@ -112,7 +138,7 @@ def mark_as_read(phone_number_id: str, message_id: str, token: str) -> dict:
     }
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = _SESSION.post(url, json=payload, headers=headers, timeout=10)
         return response.json()
     except Exception as e:
         logger.warning(f"Mark-as-read Fehler: {e}")
@@ -125,9 +151,10 @@ def get_media_url(media_id: str, token: str) -> str:
     headers = {"Authorization": f"Bearer {token}"}
 
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = _SESSION.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         return response.json().get("url")
     except Exception as e:
         logger.error(f"Media URL Fehler: {e}")
         return None
+
@@ -3,8 +3,10 @@ Gastino.ai — Database Models (SQLAlchemy)
 Multi-Tenant Schema für Hotels, Restaurants, FeWos, Bars
 """
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select
+from sqlalchemy.orm import deferred
 
 db = SQLAlchemy()
 
@@ -12,6 +14,17 @@ db = SQLAlchemy()
 def init_db(app):
     app.config["SQLALCHEMY_DATABASE_URI"] = app.config["DATABASE_URL"]
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    if not app.config["DATABASE_URL"].startswith("sqlite"):
+        # Connection-Pool pro Prozess, bemessen nach den Threads, die gleichzeitig die DB nutzen können
+        # (Default wäre 5 + 10 Overflow). Gesamt: WEB_CONCURRENCY × (pool_size + max_overflow).
+        # LIFO hält wenige Verbindungen warm statt alle reihum zu nutzen.
+        app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {
+            "pool_size": app.config.get("DB_POOL_SIZE", 20),
+            "max_overflow": app.config.get("DB_MAX_OVERFLOW", 5),
+            "pool_pre_ping": True,
+            "pool_recycle": 1800,
+            "pool_use_lifo": True,
+        })
     db.init_app(app)
     with app.app_context():
         # Import all models so create_all() creates all tables
@@ -45,10 +58,11 @@ class Tenant(db.Model):
     plan = db.Column(db.String(20), default="trial")
     active = db.Column(db.Boolean, default=True)
 
-    # Knowledge base context — was der Bot über den Betrieb weiß
-    system_context = db.Column(db.Text)  # Freitext: Zimmer, Preise, Öffnungszeiten, etc.
-    menu_context = db.Column(db.Text)    # Speisekarte / Getränkekarte
-    faq_context = db.Column(db.Text)     # Häufige Fragen
+    # Knowledge base context — was der Bot über den Betrieb weiß.
+    # Deferred: wird erst beim Zugriff (get_full_context) nachgeladen, nicht bei jedem Tenant-Lookup.
+    system_context = deferred(db.Column(db.Text), group="context")  # Freitext: Zimmer, Preise, Öffnungszeiten, etc.
+    menu_context = deferred(db.Column(db.Text), group="context")    # Speisekarte / Getränkekarte
+    faq_context = deferred(db.Column(db.Text), group="context")     # Häufige Fragen
 
     created_at = db.Column(db.DateTime, default=utcnow)
 
@@ -94,15 +108,23 @@ class Department(db.Model):
         """Prüft ob die Abteilung gerade geöffnet ist."""
         if not self.hours_json:
             return True  # Keine Zeiten definiert = immer offen
-        from datetime import datetime
-        import pytz
-        tz = pytz.timezone(self.tenant.timezone if self.tenant else "Europe/Rome")
-        now = datetime.now(tz)
-        current_time = now.strftime("%H:%M")
-        for slot in self.hours_json:
-            if slot.get("start", "00:00") <= current_time <= slot.get("end", "23:59"):
-                return True
-        return False
+        return is_open_at(self.hours_json, local_hhmm(self.tenant.timezone if self.tenant else None))
+
+
+def local_hhmm(tz_name=None):
+    """Aktuelle Uhrzeit als "HH:MM" in der Zeitzone des Betriebs."""
+    import pytz
+    return datetime.now(pytz.timezone(tz_name or "Europe/Rome")).strftime("%H:%M")
+
+
+def is_open_at(hours_json, current_time):
+    """Reine Funktion: sind die Öffnungszeiten (hours_json) um current_time ("HH:MM") offen?"""
+    if not hours_json:
+        return True
+    for slot in hours_json:
+        if slot.get("start", "00:00") <= current_time <= slot.get("end", "23:59"):
+            return True
+    return False
 
 
 # ─── GUEST (Gast) ──────────────────────────────────────
@@ -124,6 +146,7 @@ class Guest(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("tenant_id", "whatsapp_id", name="uq_tenant_guest"),
+        db.Index("ix_guests_tenant_language", "tenant_id", "language"),
     )
 
     conversations = db.relationship("Conversation", backref="guest", lazy="dynamic")
@@ -141,7 +164,11 @@ class Conversation(db.Model):
     last_intent = db.Column(db.String(50))
     pending_entities = db.Column(db.JSON, default=dict)  # Gesammelte Entities über mehrere Nachrichten
     created_at = db.Column(db.DateTime, default=utcnow)
-    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+    updated_at = db.Column(db.DateTime, default=utcnow)  # via touch_conversation(), max. alle 30 s
+
+    __table_args__ = (
+        db.Index("ix_conversations_tenant", "tenant_id"),
+    )
 
     messages = db.relationship("Message", backref="conversation", lazy="dynamic",
                                order_by="Message.created_at")
@@ -160,6 +187,10 @@ class Message(db.Model):
     metadata_json = db.Column(db.JSON)  # {intent, confidence, tokens_used}
     created_at = db.Column(db.DateTime, default=utcnow)
 
+    __table_args__ = (
+        db.Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
+
 
 # ─── ORDER (Bestellungen / Roomservice) ────────────────
 
@@ -180,6 +211,10 @@ class Order(db.Model):
     confirmed_at = db.Column(db.DateTime)
     delivered_at = db.Column(db.DateTime)
 
+    __table_args__ = (
+        db.Index("ix_orders_tenant_status_created", "tenant_id", "status", "created_at"),
+    )
+
     guest = db.relationship("Guest", backref="orders")
     department = db.relationship("Department", backref="orders")
 
@@ -199,3 +234,85 @@ class Reservation(db.Model):
     status = db.Column(db.String(20), default="confirmed")
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=utcnow)
+
+    __table_args__ = (
+        db.Index("ix_reservations_tenant_date_status", "tenant_id", "date", "status"),
+    )
+
+
+# ─── PERSISTENCE HELPERS ──────────────────────────────
+
+TOUCH_INTERVAL = timedelta(seconds=30)
+_LAST_TOUCH = {}  # conversation_id -> zuletzt geschriebenes updated_at (pro Prozess)
+_LAST_TOUCH_MAX = 10000
+
+
+def touch_conversation(conversation):
+    """Setzt updated_at höchstens alle 30 s — spart Row-Updates bei Gästen die viel schreiben."""
+    now = utcnow()
+    last = _LAST_TOUCH.get(conversation.id)
+    if last is not None and now - last <= TOUCH_INTERVAL:
+        return
+    if len(_LAST_TOUCH) >= _LAST_TOUCH_MAX:
+        _LAST_TOUCH.clear()
+    conversation.updated_at = now
+    _LAST_TOUCH[conversation.id] = now
+
+
+def persist_turn(conversation, user_msg, ai_msg=None):
+    """
+    Speichert Gast-Nachricht und AI-Antwort in einer einzigen Transaktion.
+    Beide werden erst hier zur Session hinzugefügt und im selben Flush geschrieben (ein Multi-Row-INSERT).
+    """
+    db.session.add_all([m for m in (user_msg, ai_msg) if m is not None])
+    touch_conversation(conversation)
+    db.session.commit()
+
+
+def conversation_history(conversation_id, limit=20):
+    """
+    Letzte `limit` Nachrichten chronologisch als Chat-History ([{"role", "content"}]).
+    Eine Abfrage (neueste N als Subquery, außen aufsteigend sortiert), nur zwei Spalten, keine ORM-Objekte.
+    """
+    recent = (
+        select(Message.direction, Message.content, Message.created_at)
+        .where(Message.conversation_id == conversation_id)
+        .order_by(Message.created_at.desc())
+        .limit(limit)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(recent.c.direction, recent.c.content).order_by(recent.c.created_at)
+    ).all()
+    return [{"role": "user" if direction == "inbound" else "assistant", "content": content}
+            for direction, content in rows]
+
+
+def upsert_guest(tenant_id, whatsapp_id, name=None, language="de"):
+    """
+    Gast holen oder anlegen in EINEM Statement (INSERT … ON CONFLICT auf uq_tenant_guest … RETURNING).
+    Ein vorhandener Name wird nicht überschrieben. Kein Commit — den macht der Aufrufer.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        guest = Guest.query.filter_by(tenant_id=tenant_id, whatsapp_id=whatsapp_id).first()
+        if not guest:
+            guest = Guest(tenant_id=tenant_id, whatsapp_id=whatsapp_id, name=name, language=language)
+            db.session.add(guest)
+            db.session.flush()
+        return guest
+
+    stmt = insert(Guest).values(
+        id=new_id(), tenant_id=tenant_id, whatsapp_id=whatsapp_id,
+        name=name, language=language, created_at=utcnow(),
+    )
+    # DO UPDATE statt DO NOTHING, damit RETURNING auch bei bestehendem Gast eine Zeile liefert
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["tenant_id", "whatsapp_id"],
+        set_={"name": db.func.coalesce(Guest.name, stmt.excluded.name)},
+    ).returning(Guest)
+    return db.session.scalars(stmt, execution_options={"populate_existing": True}).one()
@@ -3,12 +3,45 @@ Gastino.ai — API Routes
 REST API für Dashboard, Tenant-Management und Onboarding.
 """
 import logging
-from flask import Blueprint, request, jsonify
-from models.database import db, Tenant, Department, Guest, Order, Reservation, Conversation, Message
+from flask import Blueprint, request, jsonify, abort
+from sqlalchemy import select, or_, and_
+from core import cache
+from models.database import (
+    db, Tenant, Department, Guest, Order, Reservation, Conversation, Message,
+    is_open_at, local_hhmm,
+)
 
 logger = logging.getLogger("gastino.api")
 api_bp = Blueprint("api", __name__)
 
+STATS_CACHE_TTL = 30  # Sekunden
+TENANT_CACHE_TTL = 60  # Sekunden
+ORDERS_MAX_LIMIT = 200  # Obergrenze pro Seite
+
+
+def _tenant_core(tenant_id):
+    """
+    Stammdaten eines Tenants als dict (ohne Kontext-Spalten), TENANT_CACHE_TTL Sekunden gecacht.
+    Unbekannte IDs werden nicht gecacht — ein neu angelegter Tenant ist sofort abrufbar.
+    """
+    key = f"tenant_core:{tenant_id}"
+    tenant = cache.get(key)
+    if tenant is not None:
+        return tenant
+
+    row = db.session.execute(
+        select(Tenant.id, Tenant.name, Tenant.type, Tenant.plan,
+               Tenant.languages, Tenant.active, Tenant.created_at)
+        .where(Tenant.id == tenant_id)
+    ).one_or_none()
+    if row is None:
+        return None
+    tenant = row._asdict()
+    if tenant["created_at"]:
+        tenant["created_at"] = tenant["created_at"].isoformat()  # wie jsonify() für naive Zeitstempel
+    cache.set(key, tenant, TENANT_CACHE_TTL)
+    return tenant
+
 
 # --- TENANT MANAGEMENT ---
 
@@ -41,6 +74,7 @@ def create_tenant():
     )
     db.session.add(tenant)
     db.session.commit()
+    cache.bump("tenants")  # gemerkten aktiven Tenant (Telegram) verwerfen
 
     logger.info(f"Neuer Tenant: {tenant.name} ({tenant.type})")
     return jsonify({"id": tenant.id, "name": tenant.name}), 201
@@ -49,16 +83,10 @@ def create_tenant():
 @api_bp.route("/tenants/<tenant_id>", methods=["GET"])
 def get_tenant(tenant_id):
     """Betriebsdetails abrufen."""
-    tenant = Tenant.query.get_or_404(tenant_id)
-    return jsonify({
-        "id": tenant.id,
-        "name": tenant.name,
-        "type": tenant.type,
-        "plan": tenant.plan,
-        "languages": tenant.languages,
-        "active": tenant.active,
-        "created_at": tenant.created_at.isoformat(),
-    })
+    tenant = _tenant_core(tenant_id)
+    if tenant is None:
+        abort(404)
+    return jsonify(tenant)
 
 
 @api_bp.route("/tenants/<tenant_id>/context", methods=["PUT"])
@@ -102,14 +130,27 @@ def create_department(tenant_id):
 @api_bp.route("/tenants/<tenant_id>/departments", methods=["GET"])
 def list_departments(tenant_id):
     """Alle Abteilungen eines Betriebs."""
-    depts = Department.query.filter_by(tenant_id=tenant_id, active=True).all()
+    from sqlalchemy.orm import load_only
+
+    depts = db.session.scalars(
+        select(Department)
+        .options(load_only(Department.id, Department.name, Department.display_name,
+                           Department.whatsapp_group_id, Department.is_escalation,
+                           Department.hours_json))
+        .filter_by(tenant_id=tenant_id, active=True)
+    ).all()
+
+    # Uhrzeit einmal für alle Abteilungen statt Tenant-Lazy-Load pro Zeile
+    tz_name = db.session.scalar(select(Tenant.timezone).where(Tenant.id == tenant_id))
+    now = local_hhmm(tz_name)
+
     return jsonify([{
         "id": d.id,
         "name": d.name,
         "display_name": d.display_name,
         "has_whatsapp": bool(d.whatsapp_group_id),
         "is_escalation": d.is_escalation,
-        "is_open": d.is_open_now(),
+        "is_open": is_open_at(d.hours_json, now),
     } for d in depts])
 
 
@@ -118,70 +159,90 @@ def list_departments(tenant_id):
 @api_bp.route("/tenants/<tenant_id>/orders", methods=["GET"])
 def list_orders(tenant_id):
     """Bestellungen auflisten (für Dashboard)."""
+    from datetime import datetime, timezone
+
     status = request.args.get("status")
-    limit = request.args.get("limit", 50, type=int)
+    limit = min(max(request.args.get("limit", 50, type=int), 1), ORDERS_MAX_LIMIT)
+    before = request.args.get("before")  # Keyset-Cursor "created_at,id" der letzten Bestellung (X-Next-Cursor)
 
-    query = Order.query.filter_by(tenant_id=tenant_id)
+    stmt = select(
+        Order.id, Order.type, Order.items, Order.room_number, Order.table_number,
+        Order.status, Order.created_at, Order.confirmed_at,
+    ).where(Order.tenant_id == tenant_id)
     if status:
-        query = query.filter_by(status=status)
-
-    orders = query.order_by(Order.created_at.desc()).limit(limit).all()
-
-    return jsonify([{
-        "id": o.id,
-        "type": o.type,
-        "items": o.items,
-        "room_number": o.room_number,
-        "table_number": o.table_number,
-        "status": o.status,
-        "created_at": o.created_at.isoformat(),
-        "confirmed_at": o.confirmed_at.isoformat() if o.confirmed_at else None,
-    } for o in orders])
+        stmt = stmt.where(Order.status == status)
+    if before:
+        created, _, order_id = before.partition(",")
+        try:
+            cursor = datetime.fromisoformat(created)
+        except ValueError:
+            return jsonify({"error": "Ungültiger Cursor"}), 400
+        if cursor.tzinfo:
+            cursor = cursor.astimezone(timezone.utc).replace(tzinfo=None)
+        if order_id:
+            # id als Tie-Breaker — Bestellungen mit gleichem created_at gehen an der Seitengrenze nicht verloren
+            stmt = stmt.where(or_(Order.created_at < cursor,
+                                  and_(Order.created_at == cursor, Order.id < order_id)))
+        else:
+            stmt = stmt.where(Order.created_at < cursor)
+
+    stmt = stmt.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit)
+    orders = [dict(row) for row in db.session.execute(stmt).mappings()]
+
+    response = jsonify(orders)
+    if orders and len(orders) == limit:
+        last = orders[-1]
+        response.headers["X-Next-Cursor"] = f"{last['created_at'].isoformat()},{last['id']}"
+    return response
 
 
 # --- STATS ---
 
 @api_bp.route("/tenants/<tenant_id>/stats", methods=["GET"])
 def tenant_stats(tenant_id):
-    """Dashboard-Statistiken."""
+    """Dashboard-Statistiken (30 s gecacht — das Dashboard pollt alle paar Sekunden)."""
+    key = f"stats:{tenant_id}"
+    stats = cache.get(key)
+    if stats is None:
+        stats = _compute_tenant_stats(tenant_id)
+        cache.set(key, stats, STATS_CACHE_TTL)
+    return jsonify(stats)
+
+
+def _compute_tenant_stats(tenant_id):
     from datetime import datetime, timedelta, date
-    from sqlalchemy import func
+    from sqlalchemy import func, case
 
     today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
     week_ago = today - timedelta(days=7)
 
-    # Nachrichten heute
-    msgs_today = (
-        db.session.query(func.count(Message.id))
-        .join(Conversation)
-        .filter(
-            Conversation.tenant_id == tenant_id,
-            Message.created_at >= today
-        ).scalar()
-    )
-
-    # Nachrichten diese Woche
-    msgs_week = (
-        db.session.query(func.count(Message.id))
+    # Alle Zähler in einem Round-Trip: Nachrichten per bedingtem Aggregat,
+    # der Rest als skalare Subqueries im selben SELECT
+    tenant_msgs = (
+        select(Message.created_at)
         .join(Conversation)
-        .filter(
-            Conversation.tenant_id == tenant_id,
-            Message.created_at >= week_ago
-        ).scalar()
+        .where(Conversation.tenant_id == tenant_id, Message.created_at >= week_ago)
+        .subquery()
     )
-
-    # Aktive Gäste
-    active_guests = Guest.query.filter_by(tenant_id=tenant_id).count()
-
-    # Offene Bestellungen
-    pending_orders = Order.query.filter_by(
-        tenant_id=tenant_id, status="pending"
-    ).count()
-
-    # Reservierungen heute
-    reservations_today = Reservation.query.filter_by(
-        tenant_id=tenant_id, date=date.today(), status="confirmed"
-    ).count()
+    msgs_today, msgs_week, active_guests, pending_orders, reservations_today = db.session.execute(
+        select(
+            func.count(case((tenant_msgs.c.created_at >= today, 1))),
+            func.count(),
+            select(func.count(Guest.id))
+            .where(Guest.tenant_id == tenant_id)
+            .scalar_subquery(),
+            select(func.count(Order.id))
+            .where(Order.tenant_id == tenant_id, Order.status == "pending")
+            .scalar_subquery(),
+            select(func.count(Reservation.id))
+            .where(
+                Reservation.tenant_id == tenant_id,
+                Reservation.date == date.today(),
+                Reservation.status == "confirmed",
+            )
+            .scalar_subquery(),
+        ).select_from(tenant_msgs)
+    ).one()
 
     # Sprach-Verteilung
     lang_stats = (
@@ -191,14 +252,14 @@ def tenant_stats(tenant_id):
         .all()
     )
 
-    return jsonify({
+    return {
         "messages_today": msgs_today,
         "messages_week": msgs_week,
         "active_guests": active_guests,
         "pending_orders": pending_orders,
         "reservations_today": reservations_today,
         "languages": {lang: count for lang, count in lang_stats},
-    })
+    }
 
 
 # --- GUEST MANAGEMENT ---
@@ -3,10 +3,13 @@ Gastino.ai - Restaurant Reservation API Routes
 REST API faeuer Tischverwaltung, Reservierungen, Tagesplanung.
 """
 import logging
-from datetime import date, time, datetime
-from flask import Blueprint, request, jsonify
+from datetime import date, time
+from functools import wraps
+from flask import Blueprint, request, jsonify, current_app, stream_with_context, abort
+from sqlalchemy import update
 
 from models.database import db
+from core import cache
 from core.restaurant_engine import (
     ReservationEngine, RestaurantTable, ServicePeriod,
     ClosedDay, ReservationExtended, setup_restaurant_defaults
@@ -15,21 +18,82 @@ from core.restaurant_engine import (
 logger = logging.getLogger("gastino.restaurant_api")
 restaurant_bp = Blueprint("restaurant", __name__)
 
+VIEW_CACHE_TTL = 30  # Sekunden
+# Per PUT direkt änderbare Felder (Whitelist für UPDATE … SET)
+RESERVATION_FIELDS = frozenset({"guest_name", "party_size", "notes", "special_requests", "table_id"})
+TABLE_FIELDS = frozenset({"name", "zone", "min_seats", "max_seats", "priority", "is_combinable", "notes"})
+_WEEKDAYS = ("Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag")
+
+
+def cached_view(view):
+    """
+    Cacht erfolgreiche GET-Antworten pro Tenant + URL (inkl. Query-String).
+    Die Tenant-Version im Key wird bei jedem Schreibzugriff der Engine erhöht
+    (invalidate_availability) — alte Einträge laufen danach einfach aus.
+    Nur mit gemeinsamem Cache (REDIS_URL): lokal sähe ein anderer Worker den bump() nicht.
+    """
+    @wraps(view)
+    def wrapper(tid, *args, **kwargs):
+        if not cache.is_shared():
+            return view(tid, *args, **kwargs)
+        key = f"view:{tid}:v{cache.version(f'tenant:{tid}')}:{request.full_path}"
+        body = cache.get(key)
+        if body is not None:
+            return current_app.response_class(body, mimetype="application/json")
+
+        response = current_app.make_response(view(tid, *args, **kwargs))
+        if response.status_code == 200:
+            cache.set(key, response.get_data(as_text=True), VIEW_CACHE_TTL)
+        return response
+    return wrapper
+
+
+class InvalidInput(Exception):
+    """Fehlendes Pflichtfeld oder ungültiger Wert in Query/Body -> 400."""
+
+
+def _date_arg(name="date", default=date.today):
+    """Datum aus dem Query-String; fehlt es, direkt default() ohne String-Umweg. Ungültig -> 400."""
+    value = request.args.get(name)
+    return _parse(date.fromisoformat, value, name) if value else default()
+
+
+def _require(data, name):
+    """Pflichtfeld aus dem JSON-Body."""
+    try:
+        return data[name]
+    except (KeyError, TypeError):
+        raise InvalidInput(f"Feld fehlt: {name}")
+
+
+def _parse(parse, value, name):
+    """value mit parse (z.B. date.fromisoformat) umwandeln; Fehler -> 400 ohne Exception-Text."""
+    try:
+        return parse(value)
+    except (TypeError, ValueError):
+        raise InvalidInput(f"Ungültiger Wert für {name}")
+
+
+@restaurant_bp.errorhandler(InvalidInput)
+def bad_request(e):
+    return jsonify({"error": str(e)}), 400
+
 
 # ------ VERFaeUeGBARKEIT ----------------------------------------------------------------------------
 
 @restaurant_bp.route("/tenants/<tid>/availability", methods=["GET"])
+@cached_view
 def check_availability(tid):
     """Verfaeuegbare Slots faeuer ein Datum + Personenanzahl."""
-    target_date = request.args.get("date", date.today().isoformat())
+    target_date = _date_arg()
     party_size = request.args.get("party_size", 2, type=int)
 
     engine = ReservationEngine(tid)
     slots = engine.get_available_slots(
-        target_date=date.fromisoformat(target_date),
+        target_date=target_date,
         party_size=party_size,
     )
-    return jsonify({"date": target_date, "party_size": party_size, "slots": slots})
+    return jsonify({"date": target_date.isoformat(), "party_size": party_size, "slots": slots})
 
 
 @restaurant_bp.route("/tenants/<tid>/availability/check", methods=["POST"])
@@ -39,9 +103,9 @@ def check_specific_availability(tid):
     engine = ReservationEngine(tid)
 
     result = engine.check_availability(
-        target_date=date.fromisoformat(data["date"]),
-        target_time=time.fromisoformat(data["time"]),
-        party_size=data["party_size"],
+        target_date=_parse(date.fromisoformat, _require(data, "date"), "date"),
+        target_time=_parse(time.fromisoformat, _require(data, "time"), "time"),
+        party_size=_require(data, "party_size"),
     )
     return jsonify(result)
 
@@ -55,10 +119,10 @@ def create_reservation(tid):
     engine = ReservationEngine(tid)
 
     result = engine.create_reservation(
-        target_date=date.fromisoformat(data["date"]),
-        target_time=time.fromisoformat(data["time"]),
-        party_size=data["party_size"],
-        guest_name=data["guest_name"],
+        target_date=_parse(date.fromisoformat, _require(data, "date"), "date"),
+        target_time=_parse(time.fromisoformat, _require(data, "time"), "time"),
+        party_size=_require(data, "party_size"),
+        guest_name=_require(data, "guest_name"),
         guest_phone=data.get("guest_phone"),
         language=data.get("language", "de"),
         zone_preference=data.get("zone_preference"),
@@ -75,77 +139,84 @@ def create_reservation(tid):
 @restaurant_bp.route("/tenants/<tid>/reservations", methods=["GET"])
 def list_reservations(tid):
     """Reservierungen auflisten (mit Filtern)."""
-    target_date = request.args.get("date")
+    target_date = _date_arg(default=lambda: None)
     status = request.args.get("status")
     limit = request.args.get("limit", 100, type=int)
 
     try:
-        query = ReservationExtended.query.filter_by(tenant_id=tid)
+        R = ReservationExtended
+        query = (
+            db.session.query(
+                R.id, R.date, R.time, R.end_time, R.party_size, R.guest_name,
+                R.guest_phone, R.language, RestaurantTable.name, RestaurantTable.zone,
+                R.status, R.source, R.notes, R.special_requests, R.created_at,
+            )
+            .outerjoin(RestaurantTable, R.table_id == RestaurantTable.id)
+            .filter(R.tenant_id == tid)
+        )
         if target_date:
-            query = query.filter_by(date=date.fromisoformat(target_date))
+            query = query.filter(R.date == target_date)
         if status:
-            query = query.filter_by(status=status)
-
-        reservations = query.order_by(
-            ReservationExtended.date, ReservationExtended.time
-        ).limit(limit).all()
+            query = query.filter(R.status == status)
 
-        logger.info(f"Reservierungen gefunden: {len(reservations)} (tenant={tid}, date={target_date})")
+        # yield_per: Zeilen kommen in Blöcken vom Cursor, die Liste liegt nie komplett im Speicher.
+        # iter() führt die Abfrage sofort aus — DB-Fehler landen noch im 500-Zweig unten.
+        rows = iter(query.order_by(R.date, R.time).limit(limit).yield_per(500))
     except Exception as e:
         logger.error(f"DB-Fehler list_reservations: {e}", exc_info=True)
         return jsonify({"error": str(e)}), 500
 
-    result = []
-    for r in reservations:
-        try:
-            tbl = r.table
-            result.append({
-                "id": r.id,
-                "date": r.date.isoformat(),
-                "time": r.time.strftime("%H:%M"),
-                "end_time": r.end_time.strftime("%H:%M") if r.end_time else None,
-                "party_size": r.party_size,
-                "guest_name": r.guest_name,
-                "guest_phone": r.guest_phone,
-                "language": r.language,
-                "table": tbl.name if tbl else None,
-                "zone": tbl.zone if tbl else None,
-                "status": r.status,
-                "source": r.source,
-                "notes": r.notes,
-                "special_requests": r.special_requests,
-                "created_at": r.created_at.isoformat() if r.created_at else None,
+    dumps = current_app.json.dumps
+
+    def generate():
+        # Tupel statt ORM-Objekte; date/datetime serialisiert orjson direkt
+        yield "["
+        count = 0
+        for (rid, d, t, end, party_size, guest_name, guest_phone, language, table_name, zone,
+             res_status, source, notes, special_requests, created_at) in rows:
+            yield ("," if count else "") + dumps({
+                "id": rid,
+                "date": d,
+                "time": t.strftime("%H:%M"),
+                "end_time": end.strftime("%H:%M") if end else None,
+                "party_size": party_size,
+                "guest_name": guest_name,
+                "guest_phone": guest_phone,
+                "language": language,
+                "table": table_name,
+                "zone": zone,
+                "status": res_status,
+                "source": source,
+                "notes": notes,
+                "special_requests": special_requests,
+                "created_at": created_at,
             })
-        except Exception as e:
-            logger.error(f"Fehler bei Reservierung {r.id}: {e}")
-            result.append({
-                "id": r.id, "date": r.date.isoformat(), "time": r.time.strftime("%H:%M"),
-                "end_time": None, "party_size": r.party_size, "guest_name": r.guest_name,
-                "guest_phone": r.guest_phone, "language": r.language,
-                "table": None, "zone": None, "status": r.status, "source": r.source,
-                "notes": r.notes, "special_requests": r.special_requests, "created_at": None,
-            })
-    return jsonify(result)
+            count += 1
+        yield "]"
+        logger.info(f"Reservierungen gefunden: {count} (tenant={tid}, date={target_date})")
+
+    return current_app.response_class(stream_with_context(generate()), mimetype="application/json")
 
 
 @restaurant_bp.route("/tenants/<tid>/reservations/<rid>", methods=["PUT"])
 def update_reservation(tid, rid):
     """Reservierung aktualisieren."""
     data = request.json
-    res = ReservationExtended.query.filter_by(id=rid, tenant_id=tid).first_or_404()
-
-    if "guest_name" in data:
-        res.guest_name = data["guest_name"]
-    if "party_size" in data:
-        res.party_size = data["party_size"]
-    if "notes" in data:
-        res.notes = data["notes"]
-    if "special_requests" in data:
-        res.special_requests = data["special_requests"]
-    if "table_id" in data:
-        res.table_id = data["table_id"]
+    values = {k: v for k, v in data.items() if k in RESERVATION_FIELDS}
+    R = ReservationExtended
+
+    # Direktes UPDATE statt SELECT + UPDATE; RETURNING liefert das Datum für die Cache-Invalidierung
+    if values:
+        res_date = db.session.execute(
+            update(R).where(R.id == rid, R.tenant_id == tid).values(**values).returning(R.date)
+        ).scalar_one_or_none()
+    else:
+        res_date = db.session.query(R.date).filter_by(id=rid, tenant_id=tid).scalar()
+    if res_date is None:
+        abort(404)
 
     db.session.commit()
+    ReservationEngine(tid).invalidate_availability(res_date)
     return jsonify({"status": "updated"})
 
 
@@ -153,7 +224,7 @@ def update_reservation(tid, rid):
 def update_reservation_status(tid, rid):
     """Status einer Reservierung aeaendern (seated, completed, noshow, cancelled)."""
     data = request.json
-    new_status = data["status"]
+    new_status = _require(data, "status")
     engine = ReservationEngine(tid)
 
     actions = {
@@ -176,24 +247,23 @@ def update_reservation_status(tid, rid):
 # ------ TAGESANSICHT ------------------------------------------------------------------------------
 
 @restaurant_bp.route("/tenants/<tid>/day-overview", methods=["GET"])
+@cached_view
 def day_overview(tid):
     """Komplette Tagesaeuebersicht."""
-    target_date = request.args.get("date", date.today().isoformat())
-    engine = ReservationEngine(tid)
-    return jsonify(engine.get_day_overview(date.fromisoformat(target_date)))
+    return jsonify(ReservationEngine(tid).get_day_overview(_date_arg()))
 
 
 @restaurant_bp.route("/tenants/<tid>/table-timeline", methods=["GET"])
+@cached_view
 def table_timeline(tid):
     """Timeline: Welcher Tisch ist wann belegt?"""
-    target_date = request.args.get("date", date.today().isoformat())
-    engine = ReservationEngine(tid)
-    return jsonify(engine.get_table_timeline(date.fromisoformat(target_date)))
+    return jsonify(ReservationEngine(tid).get_table_timeline(_date_arg()))
 
 
 # ------ TISCHVERWALTUNG ----------------------------------------------------------------------
 
 @restaurant_bp.route("/tenants/<tid>/tables", methods=["GET"])
+@cached_view
 def list_tables(tid):
     """Alle Tische auflisten."""
     tables = RestaurantTable.query.filter_by(tenant_id=tid, active=True).order_by(
@@ -217,7 +287,7 @@ def create_table(tid):
     data = request.json
     table = RestaurantTable(
         tenant_id=tid,
-        name=data["name"],
+        name=_require(data, "name"),
         zone=data.get("zone", "innen"),
         min_seats=data.get("min_seats", 2),
         max_seats=data.get("max_seats", 4),
@@ -227,6 +297,7 @@ def create_table(tid):
     )
     db.session.add(table)
     db.session.commit()
+    ReservationEngine(tid).invalidate_availability()
     return jsonify({"id": table.id, "name": table.name}), 201
 
 
@@ -234,13 +305,19 @@ def create_table(tid):
 def update_table(tid, table_id):
     """Tisch bearbeiten."""
     data = request.json
-    table = RestaurantTable.query.filter_by(id=table_id, tenant_id=tid).first_or_404()
+    values = {k: v for k, v in data.items() if k in TABLE_FIELDS}
+    T = RestaurantTable
 
-    for field in ["name", "zone", "min_seats", "max_seats", "priority", "is_combinable", "notes"]:
-        if field in data:
-            setattr(table, field, data[field])
+    if values:
+        result = db.session.execute(update(T).where(T.id == table_id, T.tenant_id == tid).values(**values))
+        found = result.rowcount > 0
+    else:
+        found = db.session.query(T.id).filter_by(id=table_id, tenant_id=tid).first() is not None
+    if not found:
+        abort(404)
 
     db.session.commit()
+    ReservationEngine(tid).invalidate_availability()
     return jsonify({"status": "updated"})
 
 
@@ -250,23 +327,24 @@ def delete_table(tid, table_id):
     table = RestaurantTable.query.filter_by(id=table_id, tenant_id=tid).first_or_404()
     table.active = False
     db.session.commit()
+    ReservationEngine(tid).invalidate_availability()
     return jsonify({"status": "deactivated"})
 
 
 # ------ SERVICE-ZEITEN ------------------------------------------------------------------------
 
 @restaurant_bp.route("/tenants/<tid>/service-periods", methods=["GET"])
+@cached_view
 def list_service_periods(tid):
     """Service-Perioden auflisten."""
     periods = ServicePeriod.query.filter_by(tenant_id=tid, active=True).order_by(
         ServicePeriod.day_of_week, ServicePeriod.start_time
     ).all()
 
-    days = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
     return jsonify([{
         "id": p.id,
         "name": p.name,
-        "day": days[p.day_of_week],
+        "day": _WEEKDAYS[p.day_of_week],
         "day_of_week": p.day_of_week,
         "start_time": p.start_time.strftime("%H:%M"),
         "end_time": p.end_time.strftime("%H:%M"),
@@ -282,30 +360,31 @@ def create_service_period(tid):
     data = request.json
     period = ServicePeriod(
         tenant_id=tid,
-        name=data["name"],
-        day_of_week=data["day_of_week"],
-        start_time=time.fromisoformat(data["start_time"]),
-        end_time=time.fromisoformat(data["end_time"]),
-        last_seating=time.fromisoformat(data["last_seating"]) if data.get("last_seating") else None,
+        name=_require(data, "name"),
+        day_of_week=_require(data, "day_of_week"),
+        start_time=_parse(time.fromisoformat, _require(data, "start_time"), "start_time"),
+        end_time=_parse(time.fromisoformat, _require(data, "end_time"), "end_time"),
+        last_seating=_parse(time.fromisoformat, data["last_seating"], "last_seating") if data.get("last_seating") else None,
         slot_duration_min=data.get("slot_duration_min", 90),
         slot_interval_min=data.get("slot_interval_min", 30),
     )
     db.session.add(period)
     db.session.commit()
+    ReservationEngine(tid).invalidate_availability()
     return jsonify({"id": period.id}), 201
 
 
 # ------ RUHETAGE ------------------------------------------------------------------------------------
 
 @restaurant_bp.route("/tenants/<tid>/closed-days", methods=["GET"])
+@cached_view
 def list_closed_days(tid):
     """Ruhetage auflisten."""
     days = ClosedDay.query.filter_by(tenant_id=tid).all()
-    weekdays = ["Montag", "Dienstag", "Mittwoch", "Donnerstag", "Freitag", "Samstag", "Sonntag"]
     return jsonify([{
         "id": d.id,
         "date": d.date.isoformat() if d.date else None,
-        "recurring_weekday": weekdays[d.recurring_weekday] if d.recurring_weekday is not None else None,
+        "recurring_weekday": _WEEKDAYS[d.recurring_weekday] if d.recurring_weekday is not None else None,
         "reason": d.reason,
     } for d in days])
 
@@ -316,12 +395,15 @@ def create_closed_day(tid):
     data = request.json
     closed = ClosedDay(
         tenant_id=tid,
-        date=date.fromisoformat(data["date"]) if data.get("date") else date.today(),
+        date=_parse(date.fromisoformat, data["date"], "date") if data.get("date") else date.today(),
         recurring_weekday=data.get("recurring_weekday"),
         reason=data.get("reason", "Geschlossen"),
     )
     db.session.add(closed)
     db.session.commit()
+    engine = ReservationEngine(tid)
+    engine.invalidate_closed_days()
+    engine.invalidate_availability()
     return jsonify({"id": closed.id}), 201
 
 
@@ -330,13 +412,10 @@ def create_closed_day(tid):
 @restaurant_bp.route("/tenants/<tid>/reservation-stats", methods=["GET"])
 def reservation_stats(tid):
     """Reservierungsstatistiken."""
-    from_date = request.args.get("from")
-    to_date = request.args.get("to")
-
     engine = ReservationEngine(tid)
     stats = engine.get_stats(
-        from_date=date.fromisoformat(from_date) if from_date else None,
-        to_date=date.fromisoformat(to_date) if to_date else None,
+        from_date=_date_arg("from", default=lambda: None),
+        to_date=_date_arg("to", default=lambda: None),
     )
     return jsonify(stats)
 
@@ -357,20 +436,8 @@ def setup_restaurant(tid):
 def create_walkin(tid):
     """Schnelle Walk-in Reservierung (Gast steht vor der Taeuer)."""
     data = request.json
-    engine = ReservationEngine(tid)
-
-    now = datetime.now()
-    result = engine.create_reservation(
-        target_date=now.date(),
-        target_time=now.time().replace(second=0, microsecond=0),
-        party_size=data["party_size"],
+    result = ReservationEngine(tid).create_walkin(
+        party_size=_require(data, "party_size"),
         guest_name=data.get("guest_name", "Walk-in"),
-        source="walkin",
     )
-
-    if result["success"]:
-        # Direkt als seated markieren
-        engine.seat_guest(result["reservation"]["id"])
-        result["reservation"]["status"] = "seated"
-
     return jsonify(result), 201 if result["success"] else 409
@@ -19,11 +19,17 @@ with app.app_context():
     db.create_all()
 
     print("Loesche alte Daten...")
-    for tbl in ["reservations_v2","service_periods","closed_days","restaurant_tables","reservations","orders","messages","conversations","departments","guests","tenants"]:
-        try:
-            db.session.execute(db.text(f"DELETE FROM {tbl}"))
-        except Exception:
-            pass
+    tables = ["reservations_v2","service_periods","closed_days","restaurant_tables","reservations","orders","messages","conversations","departments","guests","tenants"]
+    if db.engine.dialect.name == "postgresql":
+        # Ein Statement statt elf, ohne Zeilen-Scan
+        db.session.execute(db.text(f"TRUNCATE TABLE {', '.join(tables)} RESTART IDENTITY CASCADE"))
+    else:
+        # SQLite kennt kein TRUNCATE
+        for tbl in tables:
+            try:
+                db.session.execute(db.text(f"DELETE FROM {tbl}"))
+            except Exception:
+                pass
     db.session.commit()
 
     print("Erstelle Test-Restaurant...")
@@ -75,9 +81,11 @@ Mittagsmenue Di-Sa 3-Gaenge 22 Euro."""
 
     today = date.today()
     tomorrow = today + timedelta(days=1)
-    tables = {t.name: t.id for t in RestaurantTable.query.filter_by(tenant_id=tenant.id).all()}
+    tables = dict(
+        db.session.query(RestaurantTable.name, RestaurantTable.id).filter_by(tenant_id=tenant.id).all()
+    )
 
-    for r in [
+    sample = [
         {"date": today, "time": time(19,0), "end_time": time(20,30), "party_size": 4,
          "guest_name": "Hofer Familie", "table_id": tables.get("Tisch 5"),
          "status": "confirmed", "source": "whatsapp", "language": "de", "notes": "Geburtstag!"},
@@ -90,8 +98,8 @@ Mittagsmenue Di-Sa 3-Gaenge 22 Euro."""
         {"date": tomorrow, "time": time(19,0), "end_time": time(20,30), "party_size": 8,
          "guest_name": "Teamessen Sparkasse", "table_id": tables.get("Tisch 6"),
          "status": "confirmed", "source": "phone", "language": "de"},
-    ]:
-        db.session.add(ReservationExtended(tenant_id=tenant.id, **r))
+    ]
+    db.session.execute(db.insert(ReservationExtended), [{"tenant_id": tenant.id, **r} for r in sample])
     db.session.commit()
 
     t = RestaurantTable.query.filter_by(tenant_id=tenant.id).count()
@@ -8,10 +8,17 @@ SETUP:
 4. Webhook setzen (Browser): https://api.telegram.org/bot{TOKEN}/setWebhook?url={APP_URL}/telegram/webhook
 """
 import logging
+import time
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import Blueprint, request, current_app
+from sqlalchemy import select, func, and_
 
-from models.database import db, Tenant, Guest, Conversation, Message
+from models.database import db, Tenant, Guest, Conversation, Message, persist_turn, conversation_history, upsert_guest, utcnow
+from core import cache
+from core.background import run_in_background, submit
 from core.intent_engine import analyze_message
 from core.message_router import route_message
 
@@ -19,6 +26,62 @@ logger = logging.getLogger("gastino.telegram")
 telegram_bp = Blueprint("telegram", __name__)
 
 TELEGRAM_API = "https://api.telegram.org/bot{token}"
+SESSION_CACHE_TTL = 3600  # Sekunden
+ACTIVE_TENANT_TTL = 60  # Sekunden
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Eine Session pro Prozess: Keep-Alive spart den TCP/TLS-Handshake pro Nachricht.
+# Retry nur für Verbindungsfehler — POSTs werden nach gesendeten Daten nicht wiederholt (keine Doppel-Nachrichten).
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=50,
+                                       max_retries=Retry(total=2, backoff_factor=0.1)))
+
+
+# ─── KOMMANDOS ──────────────────────────────────────────
+
+def _cmd_start(chat_id, arg):
+    send_telegram(chat_id, WELCOME_MSG)
+
+
+def _cmd_help(chat_id, arg):
+    send_telegram(chat_id, HELP_MSG)
+
+
+def _cmd_setroom(chat_id, arg):
+    if arg:
+        _set_guest_field(chat_id, "room_number", arg)
+        send_telegram(chat_id, f"Zimmer {arg} gespeichert.")
+    else:
+        send_telegram(chat_id, "Bitte Zimmernummer angeben: /setroom 13")
+
+
+def _cmd_settable(chat_id, arg):
+    if arg:
+        _set_guest_field(chat_id, "table_number", arg)
+        send_telegram(chat_id, f"Tisch {arg} gespeichert.")
+    else:
+        send_telegram(chat_id, "Bitte Tischnummer angeben: /settable 5")
+
+
+def _cmd_status(chat_id, arg):
+    send_telegram(chat_id, _get_status(chat_id))
+
+
+def _cmd_debug(chat_id, arg):
+    current = current_app.config.get("TELEGRAM_DEBUG", True)
+    current_app.config["TELEGRAM_DEBUG"] = not current
+    status = "AN" if not current else "AUS"
+    send_telegram(chat_id, f"Debug-Modus: {status}")
+
+
+COMMANDS = {
+    "/start": _cmd_start,
+    "/help": _cmd_help,
+    "/setroom": _cmd_setroom,
+    "/settable": _cmd_settable,
+    "/status": _cmd_status,
+    "/debug": _cmd_debug,
+}
 
 
 @telegram_bp.route("/telegram/webhook", methods=["POST"])
@@ -36,89 +99,66 @@ def telegram_webhook():
         return "OK", 200
 
     try:
-        # Kommandos abfangen
-        if text == "/start":
-            send_telegram(chat_id, WELCOME_MSG)
+        # Kommandos abfangen: erstes Wort -> Handler
+        head, _, rest = text.partition(" ")
+        handler = COMMANDS.get(head)
+        if handler:
+            handler(chat_id, rest.strip())
             return "OK", 200
 
-        if text == "/help":
-            send_telegram(chat_id, HELP_MSG)
-            return "OK", 200
-
-        if text.startswith("/setroom"):
-            parts = text.split(maxsplit=1)
-            if len(parts) >= 2:
-                _set_guest_field(chat_id, "room_number", parts[1])
-                send_telegram(chat_id, f"Zimmer {parts[1]} gespeichert.")
-            else:
-                send_telegram(chat_id, "Bitte Zimmernummer angeben: /setroom 13")
-            return "OK", 200
-
-        if text.startswith("/settable"):
-            parts = text.split(maxsplit=1)
-            if len(parts) >= 2:
-                _set_guest_field(chat_id, "table_number", parts[1])
-                send_telegram(chat_id, f"Tisch {parts[1]} gespeichert.")
-            else:
-                send_telegram(chat_id, "Bitte Tischnummer angeben: /settable 5")
-            return "OK", 200
+        # Normale Nachricht -> AI Pipeline im Hintergrund; Telegram bekommt sofort sein OK
+        # und wiederholt den Webhook nicht, wenn das LLM mal langsam ist.
+        run_in_background(_process_message_safe, chat_id, text, msg)
 
-        if text == "/status":
-            send_telegram(chat_id, _get_status(chat_id))
-            return "OK", 200
+    except Exception as e:
+        logger.error(f"Telegram-Fehler: {e}", exc_info=True)
+        send_telegram(chat_id, "Ein Fehler ist aufgetreten. Bitte versuchen Sie es erneut.")
 
-        if text == "/debug":
-            current = current_app.config.get("TELEGRAM_DEBUG", True)
-            current_app.config["TELEGRAM_DEBUG"] = not current
-            status = "AN" if not current else "AUS"
-            send_telegram(chat_id, f"Debug-Modus: {status}")
-            return "OK", 200
+    return "OK", 200
 
-        # Normale Nachricht -> AI Pipeline
-        process_message(chat_id, text, msg)
 
+def _process_message_safe(chat_id, text, raw_msg):
+    try:
+        process_message(chat_id, text, raw_msg)
     except Exception as e:
         logger.error(f"Telegram-Fehler: {e}", exc_info=True)
+        db.session.rollback()
         send_telegram(chat_id, "Ein Fehler ist aufgetreten. Bitte versuchen Sie es erneut.")
 
-    return "OK", 200
-
 
 def process_message(chat_id, text, raw_msg):
     """Verarbeitet eine Nachricht durch die Gastino-Pipeline."""
     config = current_app.config
 
-    # 1. Tenant
-    tenant = Tenant.query.filter_by(active=True).first()
-    if not tenant:
-        send_telegram(chat_id, "Kein Betrieb konfiguriert. Bitte python seed.py ausführen.")
-        return
+    # 1.-3. Tenant, Gast, Conversation
+    tenant, guest, conv = _load_session(chat_id)
+    if not conv:
+        tenant = _active_tenant()
+        if not tenant:
+            send_telegram(chat_id, "Kein Betrieb konfiguriert. Bitte python seed.py ausführen.")
+            return
 
-    # 2. Gast
-    tg_id = f"tg_{chat_id}"
-    guest = Guest.query.filter_by(tenant_id=tenant.id, whatsapp_id=tg_id).first()
-    if not guest:
         from_user = raw_msg.get("from", {})
         name = f"{from_user.get('first_name', '')} {from_user.get('last_name', '')}".strip() or None
-        guest = Guest(tenant_id=tenant.id, whatsapp_id=tg_id, name=name, language="de")
-        db.session.add(guest)
-        db.session.commit()
+        guest = upsert_guest(tenant.id, f"tg_{chat_id}", name=name)
 
-    # 3. Conversation
-    conv = Conversation.query.filter_by(tenant_id=tenant.id, guest_id=guest.id, status="active").first()
-    if not conv:
-        conv = Conversation(tenant_id=tenant.id, guest_id=guest.id, status="active")
-        db.session.add(conv)
-        db.session.commit()
+        conv = Conversation.query.filter_by(tenant_id=tenant.id, guest_id=guest.id, status="active").first()
+        if not conv:
+            # flush statt commit: Commit erfolgt zusammen mit Nachricht und Antwort
+            conv = Conversation(tenant_id=tenant.id, guest_id=guest.id, status="active")
+            db.session.add(conv)
+            db.session.flush()
+
+        cache.set(f"tg:{chat_id}", {"tenant_id": tenant.id, "guest_id": guest.id, "conversation_id": conv.id},
+                  SESSION_CACHE_TTL)
 
-    # 4. Nachricht speichern
-    db.session.add(Message(conversation_id=conv.id, direction="inbound", sender_type="guest", content=text))
-    db.session.commit()
+    # 4. Nachricht vormerken — persist_turn() schreibt sie zusammen mit der Antwort
+    inbound = Message(conversation_id=conv.id, direction="inbound", sender_type="guest", content=text,
+                      created_at=utcnow())
 
-    # 5. History
-    messages = Message.query.filter_by(conversation_id=conv.id).order_by(Message.created_at.desc()).limit(20).all()
-    messages.reverse()
-    history = [{"role": "user" if m.direction == "inbound" else "assistant", "content": m.content} for m in messages]
+    # 5. History (+ aktuelle Nachricht, die noch nicht in der DB ist)
+    history = conversation_history(conv.id, limit=config["MAX_CONVERSATION_HISTORY"] - 1)
+    history.append({"role": "user", "content": text})
 
     # 6. AI Config zusammenbauen
     ai_config = {
@@ -151,15 +191,16 @@ def process_message(chat_id, text, raw_msg):
         analysis=analysis, history=history, config=full_config,
     )
 
-    # 10. Antwort speichern + senden
+    # 10. Antwort senden + speichern — der Send läuft im Outbound-Pool parallel zum Commit
+    outbound = None
     if response_text:
-        db.session.add(Message(
+        submit("outbound", send_telegram, chat_id, response_text)
+        outbound = Message(
             conversation_id=conv.id, direction="outbound", sender_type="ai",
             content=response_text, metadata_json={"intent": analysis.get("intent")}
-        ))
+        )
         conv.last_intent = analysis.get("intent")
-        db.session.commit()
-        send_telegram(chat_id, response_text)
+    persist_turn(conv, inbound, outbound)
 
 
 def send_telegram(chat_id, text):
@@ -169,18 +210,70 @@ def send_telegram(chat_id, text):
         logger.error("TELEGRAM_TOKEN nicht gesetzt!")
         return
     url = f"{TELEGRAM_API.format(token=token)}/sendMessage"
+    # Body selbst mit orjson bauen; statische Texte (Willkommen/Hilfe) sind bereits kodiert
+    encoded_text = _ENCODED_TEXTS.get(text) or orjson.dumps(text)
+    body = b'{"chat_id":' + orjson.dumps(chat_id) + b',"text":' + encoded_text + b"}"
     try:
-        requests.post(url, json={"chat_id": chat_id, "text": text}, timeout=10)
+        _SESSION.post(url, data=body, headers=_JSON_HEADERS, timeout=10)
     except Exception as e:
         logger.error(f"Telegram senden fehlgeschlagen: {e}")
 
 
+def _load_session(chat_id):
+    """
+    (tenant, guest, conversation) über die gecachten IDs in EINER Abfrage per Primärkey; die Joins stellen
+    sicher, dass Gast und Conversation zu diesem Tenant bzw. Gast gehören.
+    Cache-Miss oder veraltete IDs (Tenant inaktiv, Conversation geschlossen): (None, None, None).
+    """
+    ids = cache.get(f"tg:{chat_id}")
+    if not ids:
+        return None, None, None
+    row = (
+        db.session.query(Tenant, Guest, Conversation)
+        .join(Guest, Guest.tenant_id == Tenant.id)
+        .join(Conversation, and_(Conversation.guest_id == Guest.id, Conversation.tenant_id == Tenant.id))
+        .filter(
+            Tenant.id == ids["tenant_id"], Tenant.active.is_(True),
+            Guest.id == ids["guest_id"],
+            Conversation.id == ids["conversation_id"], Conversation.status == "active",
+        )
+        .one_or_none()
+    )
+    if row is None:
+        cache.delete(f"tg:{chat_id}")
+        return None, None, None
+    return row
+
+
+_active_tenant_memo = {"id": None, "version": None, "expires": 0.0}
+
+
+def _active_tenant():
+    """
+    Aktiver Betrieb für den Telegram-Testbot. Die ID wird prozess-lokal ACTIVE_TENANT_TTL Sekunden gemerkt
+    (bzw. bis cache.bump("tenants")), danach nur noch Lookup per Primärkey.
+    """
+    now = time.monotonic()
+    version = cache.version("tenants")
+    memo = _active_tenant_memo
+    if memo["id"] and memo["expires"] > now and memo["version"] == version:
+        tenant = db.session.get(Tenant, memo["id"])
+        if tenant is not None and tenant.active:
+            return tenant
+
+    tenant = Tenant.query.filter_by(active=True).first()
+    memo.update(id=tenant.id if tenant else None, version=version, expires=now + ACTIVE_TENANT_TTL)
+    return tenant
+
+
 def _set_guest_field(chat_id, field, value):
     """Setzt ein Feld beim Gast-Profil."""
-    tenant = Tenant.query.filter_by(active=True).first()
-    if not tenant:
-        return
-    guest = Guest.query.filter_by(tenant_id=tenant.id, whatsapp_id=f"tg_{chat_id}").first()
+    _, guest, _ = _load_session(chat_id)
+    if not guest:
+        tenant = _active_tenant()
+        if not tenant:
+            return
+        guest = Guest.query.filter_by(tenant_id=tenant.id, whatsapp_id=f"tg_{chat_id}").first()
     if guest:
         setattr(guest, field, value)
         db.session.commit()
@@ -188,14 +281,29 @@ def _set_guest_field(chat_id, field, value):
 
 def _get_status(chat_id):
     """Debug-Status."""
-    tenant = Tenant.query.filter_by(active=True).first()
+    tenant = _active_tenant()
     if not tenant:
         return "Kein Tenant konfiguriert."
-    guest = Guest.query.filter_by(tenant_id=tenant.id, whatsapp_id=f"tg_{chat_id}").first()
-    if not guest:
+
+    # Gast (im selben Betrieb wie process_message), aktive Conversation und Nachrichtenzahl in EINER Abfrage
+    row = db.session.execute(
+        select(
+            Guest.name, Guest.language, Guest.room_number, Guest.table_number,
+            Conversation.last_intent, func.count(Message.id),
+        )
+        .select_from(Guest)
+        .outerjoin(Conversation, and_(Conversation.guest_id == Guest.id, Conversation.tenant_id == tenant.id,
+                                      Conversation.status == "active"))
+        .outerjoin(Message, Message.conversation_id == Conversation.id)
+        .where(Guest.tenant_id == tenant.id, Guest.whatsapp_id == f"tg_{chat_id}")
+        .group_by(Guest.id, Guest.name, Guest.language, Guest.room_number, Guest.table_number,
+                  Conversation.id, Conversation.last_intent, Conversation.updated_at)
+        .order_by(Conversation.updated_at.desc())  # mehrere aktive Conversations: die zuletzt genutzte
+        .limit(1)
+    ).first()
+    if row is None:
         return "Kein Gast-Profil. Schreibe eine Nachricht um eins zu erstellen."
-    conv = Conversation.query.filter_by(tenant_id=tenant.id, guest_id=guest.id, status="active").first()
-    msg_count = Message.query.filter_by(conversation_id=conv.id).count() if conv else 0
+    guest_name, language, room_number, table_number, last_intent, msg_count = row
 
     provider = current_app.config.get("AI_PROVIDER", "anthropic")
     model = current_app.config.get("AI_MODEL") or current_app.config.get("CLAUDE_MODEL", "?")
@@ -203,12 +311,12 @@ def _get_status(chat_id):
     return (
         f"--- Gastino Status ---\n"
         f"Betrieb: {tenant.name}\n"
-        f"Name: {guest.name or '-'}\n"
-        f"Sprache: {guest.language or '-'}\n"
-        f"Zimmer: {guest.room_number or '-'}\n"
-        f"Tisch: {guest.table_number or '-'}\n"
+        f"Name: {guest_name or '-'}\n"
+        f"Sprache: {language or '-'}\n"
+        f"Zimmer: {room_number or '-'}\n"
+        f"Tisch: {table_number or '-'}\n"
         f"Nachrichten: {msg_count}\n"
-        f"Letzter Intent: {conv.last_intent or '-'}\n"
+        f"Letzter Intent: {last_intent or '-'}\n"
         f"AI: {provider} / {model}"
     )
 
@@ -260,3 +368,7 @@ HELP_MSG = """Test-Szenarien:
 
 Debug zeigt Intent, Sprache und Confidence.
 /debug zum An-/Ausschalten."""
+
+
+# Statische Antworten einmal beim Import als JSON-String kodieren
+_ENCODED_TEXTS = {text: orjson.dumps(text) for text in (WELCOME_MSG, HELP_MSG)}
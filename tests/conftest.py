@@ -0,0 +1,39 @@
+"""
+Gastino.ai - Test-Setup
+Tests laufen gegen den prozess-lokalen Cache (ohne App-Kontext kein Redis).
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def local_cache():
+    """Jeder Test startet mit leerem lokalen Cache."""
+    for store in (cache._local, cache._local_lists, cache._local_versions):
+        store.clear()
+    yield
+    for store in (cache._local, cache._local_lists, cache._local_versions):
+        store.clear()
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App mit frischer SQLite-Datei (Auto-Seed legt den Test-Tenant mit phone_id "test_phone_id" an)."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'gastino.db'}")
+    monkeypatch.setenv("MESSAGE_DEBOUNCE_SECONDS", "0")
+    monkeypatch.delenv("REDIS_URL", raising=False)
+
+    from app import create_app
+    from models.database import db
+
+    app = create_app()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
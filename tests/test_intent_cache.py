@@ -0,0 +1,80 @@
+"""Intent-Cache: gleiche Nachricht in anderer Schreibweise -> kein zweiter LLM-Call."""
+from types import SimpleNamespace
+
+from core import intent_engine
+
+CONFIG = {"AI_PROVIDER": "anthropic", "AI_API_KEY": "test", "AI_MODEL": "test-model"}
+THANK_YOU = '{"intent": "thank_you", "language": "de", "entities": {}, "confidence": 0.95, "needs_human": false}'
+PARTY_SIZE = '{"intent": "reservation", "language": "de", "entities": {"party_size": 3}, "confidence": 0.95, "needs_human": false}'
+
+
+def _tenant():
+    return SimpleNamespace(id="tenant-1", get_full_context=lambda: "Hotel Test, Bozen")
+
+
+def _guest(name=None):
+    return SimpleNamespace(name=name, room_number=None, language="de")
+
+
+def _fake_llm(monkeypatch, response=THANK_YOU):
+    calls = []
+
+    def fake_completion(**kwargs):
+        calls.append(kwargs["user_message"])
+        return response
+
+    monkeypatch.setattr(intent_engine, "chat_completion", fake_completion)
+    return calls
+
+
+def _analyze(text, prior=(), guest=None):
+    # wie webhook.respond_to_guest / telegram_bot.process_message: aktuelle Nachricht roh angehängt
+    history = list(prior) + [{"role": "user", "content": text}]
+    return intent_engine.analyze_message(_tenant(), guest or _guest(), text, history, config=CONFIG)
+
+
+def test_spellings_share_one_llm_call(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+    prior = [{"role": "user", "content": "Hallo"}, {"role": "assistant", "content": "Willkommen im Hotel Test."}]
+
+    for text in ("danke", "Danke!", "DANKE"):
+        assert _analyze(text, prior)["intent"] == "thank_you"
+
+    assert calls == ["danke"]
+
+
+def test_other_guests_and_histories_share_the_entry(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+
+    _analyze("Danke!", guest=_guest("Anna"))
+    _analyze("danke", [{"role": "assistant", "content": "Ihr Tisch ist reserviert."}], guest=_guest("Marco"))
+
+    assert calls == ["Danke!"]
+
+
+def test_open_bot_question_gets_its_own_entry(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+
+    _analyze("danke")
+    _analyze("danke", [{"role": "assistant", "content": "Für wie viele Personen?"}])
+
+    assert calls == ["danke", "danke"]
+
+
+def test_results_with_entities_are_not_cached(monkeypatch):
+    calls = _fake_llm(monkeypatch, PARTY_SIZE)
+    prior = [{"role": "assistant", "content": "Für wie viele Personen?"}]
+
+    _analyze("3", prior)
+    _analyze("3", prior)
+
+    assert calls == ["3", "3"]
+
+
+def test_different_messages_are_not_shared(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+
+    _analyze("danke")
+    _analyze("hallo")
+
+    assert calls == ["danke", "hallo"]
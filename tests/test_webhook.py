@@ -0,0 +1,57 @@
+"""Webhook: Nachrichten desselben Gastes aus getrennten Webhooks werden nacheinander beantwortet."""
+import threading
+import time
+
+import orjson
+
+import webhook
+from models.database import Conversation, Guest, Message
+
+SENDER = "4917600000001"
+
+
+def _payload(wamid, text, timestamp):
+    return orjson.dumps({"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "test_phone_id"},
+        "contacts": [{"profile": {"name": "Anna"}, "wa_id": SENDER}],
+        "messages": [{"from": SENDER, "id": wamid, "timestamp": timestamp,
+                      "type": "text", "text": {"body": text}}],
+    }}]}]})
+
+
+def test_two_payloads_for_one_sender_are_serialized(app, monkeypatch):
+    events = []
+
+    def slow_analyze(tenant, guest, text, history, **kwargs):
+        events.append(("start", text))
+        time.sleep(0.2)  # LLM-Call — der zweite Webhook trifft mitten in diesen Turn
+        events.append(("end", text))
+        return {"intent": "general_question", "language": "de", "entities": {}, "confidence": 0.9}
+
+    monkeypatch.setattr(webhook, "analyze_message", slow_analyze)
+    monkeypatch.setattr(webhook, "route_message", lambda **kw: "ok: " + kw["history"][-1]["content"])
+    monkeypatch.setattr(webhook, "enqueue_text_message", lambda **kw: None)
+    monkeypatch.setattr(webhook, "submit", lambda *args, **kwargs: None)  # mark_as_read
+    # Batches direkt im aufrufenden Thread — zwei Threads stehen für zwei parallele Webhooks
+    monkeypatch.setattr(webhook, "run_in_background", lambda fn, *args: fn(*args))
+
+    def deliver(raw):
+        with app.app_context():
+            webhook.process_webhook_payload(raw)
+
+    first = threading.Thread(target=deliver, args=(_payload("wamid.1", "eins", "1767000000"),))
+    second = threading.Thread(target=deliver, args=(_payload("wamid.2", "zwei", "1767000001"),))
+    first.start()
+    time.sleep(0.05)
+    second.start()
+    first.join()
+    second.join()
+
+    assert events == [("start", "eins"), ("end", "eins"), ("start", "zwei"), ("end", "zwei")]
+    with app.app_context():
+        conversations = Conversation.query.join(Guest, Conversation.guest_id == Guest.id) \
+            .filter(Guest.whatsapp_id == SENDER).all()
+        assert len(conversations) == 1
+        contents = [m.content for m in Message.query.filter_by(conversation_id=conversations[0].id)
+                    .order_by(Message.created_at)]
+        assert contents == ["eins", "ok: eins", "zwei", "ok: zwei"]
@@ -3,15 +3,26 @@ Gastino.ai — WhatsApp Webhook Handler
 Empfängt alle eingehenden WhatsApp-Nachrichten und orchestriert die Verarbeitung.
 """
 import logging
+import threading
+import orjson
 from flask import Blueprint, request, current_app, jsonify
 
-from models.database import db, Tenant, Guest, Conversation, Message
+from models.database import db, Tenant, Guest, Conversation, Message, persist_turn, upsert_guest, conversation_history, utcnow
+from core import cache
 from core.intent_engine import analyze_message
 from core.message_router import route_message
+from core.order_processor import confirm_latest_order
+from core.background import submit, run_in_background, run_later
+from integrations.whatsapp import mark_as_read, enqueue_text_message
 
 logger = logging.getLogger("gastino.webhook")
 webhook_bp = Blueprint("webhook", __name__)
 
+TENANT_CACHE_TTL = 300  # Sekunden
+DEDUP_TTL = 86400  # Sekunden — so lange erkennen wir von Meta wiederholte Nachrichten
+SENDER_LOCK_SHARDS = 64  # prozess-lokale Sperren, Absender per Hash verteilt
+CLAIM_TTL = 300  # Sekunden — so lange gilt eine wamid als "in Arbeit"; erst der gespeicherte Turn sperrt DEDUP_TTL lang
+
 
 @webhook_bp.route("/webhook", methods=["GET"])
 def verify_webhook():
@@ -24,92 +35,185 @@ def verify_webhook():
         logger.info("Webhook verifiziert!")
         return challenge, 200
 
-    logger.warning(f"Webhook-Verifizierung fehlgeschlagen: mode={mode}, token={token}")
+    logger.warning("Webhook-Verifizierung fehlgeschlagen: mode=%s, token=%s", mode, token)
     return "Forbidden", 403
 
 
 @webhook_bp.route("/webhook", methods=["POST"])
 def receive_message():
-    """Haupteingang für alle WhatsApp-Nachrichten."""
-    data = request.json
+    """Haupteingang für alle WhatsApp-Nachrichten — nur entgegennehmen, alles Weitere im Hintergrund."""
+    # Rohen Body weiterreichen: kein Parsen im Request, Meta bekommt sein 200 in Millisekunden
+    # und wiederholt den Webhook nicht, auch wenn Claude gerade langsam ist.
+    raw = request.get_data()
+    if raw:
+        run_in_background(process_webhook_payload, raw)
+
+    # Immer 200 zurückgeben — Meta wiederholt sonst
+    return "OK", 200
 
-    if not data:
-        return "OK", 200
 
+def process_webhook_payload(raw: bytes):
+    """Parst einen Webhook-Body und verteilt die Nachrichten pro Absender auf den Pool (Hintergrund)."""
     try:
-        # Meta sendet verschiedene Event-Typen
-        entry = data.get("entry", [])
-        for e in entry:
-            changes = e.get("changes", [])
-            for change in changes:
-                value = change.get("value", {})
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError as ex:
+        logger.warning("Ungültiger Webhook-Body: %s", ex)
+        return
+    if not isinstance(data, dict):
+        return
 
-                # Status-Updates ignorieren (delivered, read, etc.)
-                if "statuses" in value:
-                    continue
+    batches = {}  # Absender -> [(phone_number_id, msg, value), ...]
+    # Meta sendet verschiedene Event-Typen — entry/changes einmal flach durchlaufen
+    for change in (c for e in data.get("entry", ()) for c in e.get("changes", ())):
+        value = change.get("value", {})
 
-                messages = value.get("messages", [])
-                if not messages:
-                    continue
+        # Status-Updates ignorieren (delivered, read, etc.)
+        if "statuses" in value:
+            continue
 
-                # Metadata: Welche WhatsApp-Nummer wurde kontaktiert?
-                metadata = value.get("metadata", {})
-                phone_number_id = metadata.get("phone_number_id")
+        messages = value.get("messages")
+        if not messages:
+            continue
 
-                for msg in messages:
-                    process_incoming_message(phone_number_id, msg, value)
+        # Metadata: Welche WhatsApp-Nummer wurde kontaktiert?
+        phone_number_id = value.get("metadata", {}).get("phone_number_id")
 
-    except Exception as ex:
-        logger.error(f"Webhook-Fehler: {ex}", exc_info=True)
+        for msg in messages:
+            batches.setdefault(msg.get("from"), []).append((phone_number_id, msg, value))
 
-    # Immer 200 zurückgeben — Meta wiederholt sonst
-    return "OK", 200
+    # Verschiedene Gäste parallel (begrenzt durch den Pool),
+    # Nachrichten desselben Gastes nacheinander, damit der Verlauf stimmt.
+    for batch in batches.values():
+        run_in_background(process_webhook_batch, batch)
+
+
+def process_webhook_batch(batch: list):
+    """Verarbeitet die Nachrichten eines Absenders aus einem Webhook-Aufruf (Hintergrund-Thread, eigener App-Kontext)."""
+    for phone_number_id, msg, value in batch:
+        try:
+            process_incoming_message(phone_number_id, msg, value)
+        except Exception as ex:
+            logger.error("Fehler bei Nachricht %s: %s", msg.get("id"), ex, exc_info=True)
+            db.session.rollback()
+            release_wamids([msg.get("id")])
 
 
 def process_incoming_message(phone_number_id: str, msg: dict, value: dict):
     """Verarbeitet eine einzelne eingehende Nachricht."""
 
+    # Meta liefert Webhooks bei Timeouts erneut — jede wamid nur einmal verarbeiten
+    # (sonst doppelter Claude-Call und doppelte Antwort). Vorerst nur kurz beanspruchen:
+    # geht die Nachricht verloren, bevor der Turn gespeichert ist, darf eine Wiederholung durch.
+    delay = current_app.config.get("MESSAGE_DEBOUNCE_SECONDS", 0)
+    wamid = msg.get("id")
+    if wamid and not cache.add(f"wamid:{wamid}", 1, CLAIM_TTL + int(delay)):
+        logger.info("Duplikat ignoriert: %s", wamid)
+        return
+
     msg_type = msg.get("type")
     sender_wa_id = msg.get("from")  # Gast WhatsApp-ID
 
     # Nur Textnachrichten verarbeiten (Bilder, Audio etc. → v2)
     if msg_type != "text":
-        logger.info(f"Nicht-Text-Nachricht ignoriert: type={msg_type}")
+        logger.info("Nicht-Text-Nachricht ignoriert: type=%s", msg_type)
         return
 
-    text = msg.get("text", {}).get("body", "").strip()
+    text = (msg.get("text") or {}).get("body", "").strip()
     if not text:
         return
 
-    logger.info(f"Nachricht empfangen von {sender_wa_id}: {text[:80]}...")
+    logger.info("Nachricht empfangen von %s: %.80s...", sender_wa_id, text)
 
     # ─── 1. Tenant identifizieren ───
-    tenant = Tenant.query.filter_by(
-        whatsapp_phone_id=phone_number_id,
-        active=True
-    ).first()
+    tenant = get_tenant_by_phone_id(phone_number_id)
 
     if not tenant:
-        logger.warning(f"Kein Tenant für phone_id={phone_number_id}")
+        logger.warning("Kein Tenant für phone_id=%s", phone_number_id)
         return
 
     # ─── 2. Prüfen ob es eine Gruppen-Nachricht ist (Staff-Antwort) ───
     # Gruppen-Nachrichten haben ein "group" Feld — das ist z.B. die Bar die ✅ antwortet
-    if is_group_message(value):
-        handle_group_reply(tenant, msg, value)
+    if is_group_message(msg):
+        handle_group_reply(tenant, msg, text)
+        confirm_wamids([wamid])
         return
 
+    # Blaue Häkchen im Hintergrund — läuft parallel zur Verarbeitung
+    if wamid:
+        submit("outbound", mark_as_read, phone_number_id, wamid,
+               current_app.config["WHATSAPP_TOKEN"])
+
+    # ─── Debounce: schnell hintereinander geschickte Nachrichten ("Hallo" / "ob ihr" / "Frühstück habt")
+    # sammeln und gemeinsam mit EINEM Claude-Call beantworten. Festes Fenster: die erste Nachricht plant
+    # die Verarbeitung MESSAGE_DEBOUNCE_SECONDS später, alles bis dahin Eingetroffene kommt mit.
+    # Mit Zeitstempel puffern — die Pool-Threads pushen nicht zwingend in Sende-Reihenfolge ───
+    key = f"debounce:{tenant.id}:{sender_wa_id}"
+    if delay > 0 and cache.push(key, [msg.get("timestamp") or "0", wamid, text], int(delay) + 60):
+        # Nur die erste Nachricht plant die Verarbeitung, weitere hängen sich nur an
+        if cache.add(f"{key}:scheduled", 1, int(delay) + 30):
+            run_later(delay, flush_debounced, tenant.id, phone_number_id, sender_wa_id, value)
+        return
+
+    respond_to_guest(tenant, phone_number_id, sender_wa_id, text, value)
+    confirm_wamids([wamid])
+
+
+def flush_debounced(tenant_id: str, phone_number_id: str, sender_wa_id: str, value: dict):
+    """Beantwortet alle gesammelten Nachrichten eines Gastes als eine (Hintergrund, nach dem Debounce)."""
+    key = f"debounce:{tenant_id}:{sender_wa_id}"
+    # Erst die Markierung löschen, dann leeren — was danach kommt, plant seine eigene Verarbeitung
+    cache.delete(f"{key}:scheduled")
+    entries = cache.pop_all(key)
+    tenant = db.session.get(Tenant, tenant_id) if entries else None
+    if not tenant:
+        return
+    # Sende-Reihenfolge laut Meta-Zeitstempel (Sekunden); gleiche Sekunde: Reihenfolge im Puffer (stabile Sortierung)
+    entries.sort(key=lambda entry: int(entry[0]))
+    wamids = [wamid for _, wamid, _ in entries]
+    try:
+        respond_to_guest(tenant, phone_number_id, sender_wa_id, "\n".join(text for _, _, text in entries), value)
+        confirm_wamids(wamids)
+    except Exception as ex:
+        logger.error("Fehler bei Nachrichten von %s: %s", sender_wa_id, ex, exc_info=True)
+        db.session.rollback()
+        release_wamids(wamids)
+
+
+_sender_locks = [threading.Lock() for _ in range(SENDER_LOCK_SHARDS)]
+
+
+def respond_to_guest(tenant: Tenant, phone_number_id: str, sender_wa_id: str, text: str, value: dict):
+    """
+    Ein Turn für einen Gast. Meta schickt Nachrichten desselben Gastes oft als getrennte Webhooks,
+    die parallel im Pool landen — Turns eines Gastes laufen deshalb nacheinander:
+    im Prozess über eine Sperre pro Absender, über Worker hinweg über die Gast-Zeile (SELECT … FOR UPDATE
+    bis zum Commit in persist_turn). Sonst doppelte aktive Conversations, vermischte History, Antworten
+    in falscher Reihenfolge.
+    """
+    with _sender_locks[hash((tenant.id, sender_wa_id)) % SENDER_LOCK_SHARDS]:
+        try:
+            _respond_turn(tenant, phone_number_id, sender_wa_id, text, value)
+        except Exception:
+            db.session.rollback()  # Zeilensperre freigeben, bevor der nächste Turn dran ist
+            raise
+
+
+def _respond_turn(tenant: Tenant, phone_number_id: str, sender_wa_id: str, text: str, value: dict):
+    """Gast, Conversation, Claude, Routing, Antwort — ein Turn, ein Commit."""
+    config = current_app.config
+
     # ─── 3. Gast identifizieren oder anlegen ───
     guest = get_or_create_guest(tenant, sender_wa_id, value)
 
     # ─── 4. Conversation holen oder erstellen ───
     conversation = get_active_conversation(tenant, guest)
 
-    # ─── 5. Nachricht speichern ───
-    save_message(conversation, text, "inbound", "guest")
+    # ─── 5. Nachricht vormerken — erst persist_turn() schreibt sie, zusammen mit der Antwort in einem INSERT ───
+    inbound = save_message(conversation, text, "inbound", "guest")
 
-    # ─── 6. Konversationshistorie laden ───
-    history = get_conversation_history(conversation)
+    # ─── 6. Konversationshistorie laden (+ aktuelle Nachricht, die noch nicht in der DB ist) ───
+    history = conversation_history(conversation.id, limit=config["MAX_CONVERSATION_HISTORY"] - 1)
+    history.append({"role": "user", "content": text})
 
     # ─── 7. Intent analysieren (Claude) ───
     analysis = analyze_message(
@@ -117,11 +221,11 @@ def process_incoming_message(phone_number_id: str, msg: dict, value: dict):
         guest=guest,
         text=text,
         history=history,
-        model=current_app.config["CLAUDE_MODEL"],
-        api_key=current_app.config["ANTHROPIC_API_KEY"]
+        model=config["CLAUDE_MODEL"],
+        api_key=config["ANTHROPIC_API_KEY"]
     )
 
-    logger.info(f"Intent: {analysis.get('intent')} (confidence: {analysis.get('confidence', 0):.2f})")
+    logger.info("Intent: %s (confidence: %.2f)", analysis.get("intent"), analysis.get("confidence") or 0)
 
     # ─── 8. Nachricht routen ───
     response_text = route_message(
@@ -130,55 +234,80 @@ def process_incoming_message(phone_number_id: str, msg: dict, value: dict):
         conversation=conversation,
         analysis=analysis,
         history=history,
-        config=current_app.config
+        config=config
     )
 
     # ─── 9. Antwort speichern und senden ───
+    outbound = None
     if response_text:
-        save_message(conversation, response_text, "outbound", "ai",
-                     metadata={"intent": analysis.get("intent"),
-                               "confidence": analysis.get("confidence")})
+        outbound = save_message(conversation, response_text, "outbound", "ai",
+                                metadata={"intent": analysis.get("intent"),
+                                          "confidence": analysis.get("confidence")})
 
-        from integrations.whatsapp import send_text_message
-        send_text_message(
+        enqueue_text_message(
             phone_number_id=phone_number_id,
             to=sender_wa_id,
             text=response_text,
-            token=current_app.config["WHATSAPP_TOKEN"]
+            token=config["WHATSAPP_TOKEN"]
         )
 
-    # ─── 10. Conversation updaten ───
+    # ─── 10. Conversation updaten — ein Commit für den ganzen Turn ───
     conversation.last_intent = analysis.get("intent")
-    db.session.commit()
+    persist_turn(conversation, inbound, outbound)
 
 
 # ─── HELPER FUNCTIONS ───────────────────────────────────
 
-def get_or_create_guest(tenant: Tenant, wa_id: str, value: dict) -> Guest:
-    """Gast finden oder neu anlegen."""
-    guest = Guest.query.filter_by(
-        tenant_id=tenant.id,
-        whatsapp_id=wa_id
-    ).first()
+def confirm_wamids(wamids: list):
+    """Gespeicherte Nachrichten: wamids DEDUP_TTL lang als verarbeitet markieren."""
+    for wamid in wamids:
+        if wamid:
+            cache.set(f"wamid:{wamid}", 1, DEDUP_TTL)
 
-    if not guest:
-        # Name aus WhatsApp-Profil extrahieren (wenn verfügbar)
-        contacts = value.get("contacts", [])
-        name = None
-        if contacts:
-            profile = contacts[0].get("profile", {})
-            name = profile.get("name")
 
-        guest = Guest(
-            tenant_id=tenant.id,
-            whatsapp_id=wa_id,
-            name=name,
-            language="de"  # Default, wird beim ersten Intent-Check aktualisiert
-        )
-        db.session.add(guest)
-        db.session.commit()
-        logger.info(f"Neuer Gast angelegt: {name or wa_id}")
+def release_wamids(wamids: list):
+    """Fehlgeschlagene Nachrichten freigeben — eine Wiederholung von Meta wird dann wieder verarbeitet."""
+    keys = [f"wamid:{wamid}" for wamid in wamids if wamid]
+    if keys:
+        cache.delete(*keys)
+
+
+def get_tenant_by_phone_id(phone_number_id: str):
+    """
+    Aktiver Tenant zur WhatsApp phone_number_id. Die Zuordnung (nur die ID) liegt TENANT_CACHE_TTL Sekunden
+    im Cache, danach genügt ein Lookup per Primärkey.
+    """
+    key = f"tenant_phone:{phone_number_id}"
+    tenant_id = cache.get(key)
+    if tenant_id:
+        tenant = db.session.get(Tenant, tenant_id)
+        if tenant is not None and tenant.active:
+            return tenant
+        cache.delete(key)
 
+    tenant = Tenant.query.filter_by(whatsapp_phone_id=phone_number_id, active=True).first()
+    if tenant:
+        cache.set(key, tenant.id, TENANT_CACHE_TTL)
+    return tenant
+
+
+def get_or_create_guest(tenant: Tenant, wa_id: str, value: dict) -> Guest:
+    """
+    Gast finden oder neu anlegen. Bekannte Gäste (der Normalfall): ein SELECT … FOR UPDATE, der die Zeile
+    bis zum Ende des Turns sperrt (SQLite ignoriert das). Neue Gäste: UPSERT — auch bei zwei gleichzeitigen
+    ersten Nachrichten kein Duplikat, die eingefügte/aktualisierte Zeile ist ebenso gesperrt.
+    """
+    guest = Guest.query.filter_by(tenant_id=tenant.id, whatsapp_id=wa_id).with_for_update().first()
+    if guest:
+        return guest
+
+    # Name aus WhatsApp-Profil (wenn verfügbar)
+    contacts = value.get("contacts", [])
+    name = contacts[0].get("profile", {}).get("name") if contacts else None
+
+    # Sprache "de" als Default, wird beim ersten Intent-Check aktualisiert
+    guest = upsert_guest(tenant.id, wa_id, name=name, language="de")
+    logger.info("Neuer Gast angelegt: %s", name or wa_id)
     return guest
 
 
@@ -197,66 +326,42 @@ def get_active_conversation(tenant: Tenant, guest: Guest) -> Conversation:
             status="active"
         )
         db.session.add(conv)
-        db.session.commit()
+        db.session.flush()
 
     return conv
 
 
 def save_message(conversation: Conversation, content: str, direction: str,
                  sender_type: str, metadata: dict = None):
-    """Nachricht in DB speichern."""
-    msg = Message(
+    """
+    Nachricht anlegen, aber noch nicht zur Session hinzufügen — sonst würde sie beim nächsten Query
+    einzeln geflusht. persist_turn() schreibt Gast-Nachricht und Antwort gemeinsam.
+    """
+    return Message(
         conversation_id=conversation.id,
         direction=direction,
         sender_type=sender_type,
         content=content,
-        metadata_json=metadata
-    )
-    db.session.add(msg)
-    db.session.commit()
-    return msg
-
-
-def get_conversation_history(conversation: Conversation, limit: int = 20) -> list:
-    """Letzte N Nachrichten der Konversation als Chat-History für Claude."""
-    messages = (
-        Message.query
-        .filter_by(conversation_id=conversation.id)
-        .order_by(Message.created_at.desc())
-        .limit(limit)
-        .all()
+        metadata_json=metadata,
+        created_at=utcnow(),  # Empfangs-/Antwortzeitpunkt, nicht Commit-Zeitpunkt
     )
-    messages.reverse()  # Chronologische Reihenfolge
 
-    history = []
-    for m in messages:
-        role = "user" if m.direction == "inbound" else "assistant"
-        history.append({"role": role, "content": m.content})
 
-    return history
-
-
-def is_group_message(value: dict) -> bool:
+def is_group_message(msg: dict) -> bool:
     """Prüft ob die Nachricht aus einer WhatsApp-Gruppe kommt."""
-    messages = value.get("messages", [])
-    if messages:
-        # Gruppen-Nachrichten haben ein zusätzliches "context" oder "group_id" Feld
-        # In der Meta Cloud API: Prüfe ob es ein "group" context gibt
-        return messages[0].get("context", {}).get("group_id") is not None
-    return False
+    # Gruppen-Nachrichten haben ein zusätzliches "context" oder "group_id" Feld
+    # In der Meta Cloud API: Prüfe ob es ein "group" context gibt
+    return "context" in msg and msg["context"].get("group_id") is not None
 
 
-def handle_group_reply(tenant: Tenant, msg: dict, value: dict):
+def handle_group_reply(tenant: Tenant, msg: dict, text: str):
     """
     Verarbeitet Antworten aus Staff-WhatsApp-Gruppen.
     z.B. Bar antwortet mit ✅ auf eine Bestellung.
+    text ist der bereits extrahierte, getrimmte Nachrichtentext.
     """
-    text = msg.get("text", {}).get("body", "").strip()
-
     if current_app.config["ORDER_CONFIRMATION_EMOJI"] in text:
         # Letzte unbestätigte Bestellung für diese Gruppe finden
-        from core.order_processor import confirm_latest_order
-        group_id = msg.get("context", {}).get("group_id")
-        confirm_latest_order(tenant, group_id)
+        confirm_latest_order(tenant, msg["context"]["group_id"])
 
-    logger.info(f"Gruppen-Antwort verarbeitet: {text[:50]}")
+    logger.info("Gruppen-Antwort verarbeitet: %.50s", text)